@@ -0,0 +1,71 @@
+import time
+import pandas as pd
+from EventFlattener import flatten_events
+from FakeMISPServer import generate_event
+from MISPHarvester import build_event_data
+from TextSanitiser import clean_text
+
+def make_events(num_events, attributes_per_event):
+    """Build synthetic events in official.json format, with a few awkward values mixed in."""
+    events = [build_event_data(generate_event(event_id, attributes_per_event)['Event']) for event_id in range(1, num_events + 1)]
+    for event in events[::7]:
+        event_data = event['Event']
+        event_data['info'] = "Line one\r\nLine\ttwo\x00​"
+        event_data['threat_level_id'] = None
+        event_data['RelatedEvents'] = [{'Event': {'id': '1', 'info': 'related', 'Org': {'name': 'CERT'}}}]
+        event_data['Attributes'].append({'id': 99, 'type': 'float', 'category': 'Other', 'value': 0.5, 'to_ids': True})
+        event_data['Tags'].append({})
+    return events
+
+def expand_nested_fields(df_event, event_data, key):
+    """Expand nested fields like 'Attributes' into separate rows."""
+    expanded_rows = []
+    if key in event_data:
+        for item in event_data[key]:
+            df_temp = pd.json_normalize(item)
+            df_temp = df_temp.applymap(clean_text)
+            df_temp['event_id'] = df_event['event_id'].iloc[0]  # Associate with the main event ID
+            expanded_rows.append(df_temp)
+    if expanded_rows:
+        return pd.concat(expanded_rows, ignore_index=True)
+    return pd.DataFrame()
+
+def event_to_dataframe(event):
+    """Flatten one event and its nested fields into rows, event row first."""
+    event_data = event['Event']
+    df_event = pd.json_normalize(event_data)
+    df_event = df_event.applymap(clean_text)
+    if 'id' in df_event.columns:
+        df_event.rename(columns={'id': 'event_id'}, inplace=True)
+    df_event.drop(columns=[col for col in ['Attributes', 'RelatedEvents', 'Tags', 'Galaxies', 'Clusters'] if col in df_event.columns], inplace=True)
+    df_combined = df_event
+    for key in ['Attributes', 'RelatedEvents', 'Tags', 'Galaxies', 'Clusters']:
+        df_expanded = expand_nested_fields(df_event, event_data, key)
+        if not df_expanded.empty:
+            df_combined = pd.concat([df_combined, df_expanded], ignore_index=True)
+    return df_combined
+
+def current_path(events):
+    """Flatten events the way MISPJson_To_CSV.py did before the single-pass flattener, kept here as the reference."""
+    return pd.concat([event_to_dataframe(event) for event in events], ignore_index=True)
+
+def benchmark(function, events):
+    start_time = time.perf_counter()
+    df = function(events)
+    elapsed = time.perf_counter() - start_time
+    return df, elapsed
+
+if __name__ == '__main__':
+    for num_events, attributes_per_event in [(200, 20), (400, 50)]:
+        events = make_events(num_events, attributes_per_event)
+        old_df, old_seconds = benchmark(current_path, events)
+        new_df, new_seconds = benchmark(flatten_events, events)
+
+        # Both paths must produce the same columns, in the same order, and the same CSV output
+        assert list(old_df.columns) == list(new_df.columns), "Column order differs"
+        assert old_df.to_csv(index=False) == new_df.to_csv(index=False), "CSV output differs"
+
+        print(f"{num_events} events x {attributes_per_event} attributes, {len(new_df)} rows")
+        print(f"  json_normalize path: {len(old_df) / old_seconds:>12,.0f} rows/s ({old_seconds:.2f}s)")
+        print(f"  single-pass path:    {len(new_df) / new_seconds:>12,.0f} rows/s ({new_seconds:.2f}s)")
+        print(f"  Speed-up: {old_seconds / new_seconds:.1f}x")
@@ -0,0 +1,61 @@
+import glob
+import os
+import tempfile
+import time
+import pandas as pd
+from EventFlattener import flatten_events
+from FakeMISPServer import generate_event
+from MISPHarvester import build_event_data
+from MISPJson_To_CSV import mask_repeated_values
+from ShardManifest import refresh_manifest
+from Storage import convert_shards, list_partitions, list_parts, read_dataset, shard_number
+
+def write_csv_shards(directory, num_events, attributes_per_event, num_rows_per_file):
+    """Write synthetic events, four hours apart, as official_part_N.csv shards the way the converter does."""
+    events = [build_event_data(generate_event(event_id, attributes_per_event, 1600000000 + event_id * 14400)['Event']) for event_id in range(1, num_events + 1)]
+    df = mask_repeated_values(flatten_events(events))
+    for file_index, start in enumerate(range(0, len(df), num_rows_per_file), start=1):
+        df.iloc[start:start + num_rows_per_file].to_csv(os.path.join(directory, f"official_part_{file_index}.csv"), index=False)
+    return sorted(glob.glob(os.path.join(directory, 'official_part_*.csv')), key=shard_number)
+
+def directory_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+def benchmark(function):
+    start_time = time.perf_counter()
+    df = function()
+    return df, time.perf_counter() - start_time
+
+def read_csv_shards(csv_files, columns=None):
+    usecols = None if columns is None else (lambda column: column in columns)
+    return pd.concat([pd.read_csv(csv_file, usecols=usecols, low_memory=False) for csv_file in csv_files], ignore_index=True)
+
+if __name__ == '__main__':
+    num_events = 6000
+    attributes_per_event = 50
+    num_rows_per_file = 100000
+    columns = ['event_id', 'date', 'type', 'value']
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_files = write_csv_shards(directory, num_events, attributes_per_event, num_rows_per_file)
+        manifest = refresh_manifest(csv_files, directory)
+        dataset_dir = os.path.join(directory, 'dataset')
+        convert_shards(csv_files, dataset_dir, manifest, 'parquet')
+        recent_months = list_partitions(dataset_dir)[-6:]
+
+        parts = list_parts(dataset_dir, backend='parquet')
+        print(f"{len(csv_files)} CSV shards, {len(parts)} parquet partition files over {len(list_partitions(dataset_dir))} months")
+        print(f"Disk size: CSV {directory_size(csv_files) / 1e6:.1f} MB, parquet {directory_size(parts) / 1e6:.1f} MB")
+
+        cases = [
+            ('All columns', lambda: read_csv_shards(csv_files), lambda: read_dataset(dataset_dir)),
+            (f"{len(columns)} columns", lambda: read_csv_shards(csv_files, columns), lambda: read_dataset(dataset_dir, columns)),
+            (f"{len(columns)} columns, last 6 months", lambda: read_csv_shards(csv_files, columns), lambda: read_dataset(dataset_dir, columns, recent_months)),
+        ]
+        for name, csv_load, parquet_load in cases:
+            csv_df, csv_seconds = benchmark(csv_load)
+            parquet_df, parquet_seconds = benchmark(parquet_load)
+            print(f"{name}:")
+            print(f"  CSV shards: {len(csv_df):>9,} rows in {csv_seconds:.2f}s")
+            print(f"  parquet:    {len(parquet_df):>9,} rows in {parquet_seconds:.2f}s")
+            print(f"  Speed-up: {csv_seconds / parquet_seconds:.1f}x")
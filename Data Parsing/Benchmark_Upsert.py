@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import pandas as pd
+from Upsert import upsert
+
+ADVISORY_COLUMNS = ['Original_Release_Date', 'Last_Updated', 'Vendor', 'Product', 'CVE_Number', 'Cumulative_CVSS', 'CVSS_Severity']
+
+def make_tables(num_rows, num_advisories, num_new, seed=0):
+    """Build a MISP-style shard with advisory rows after its event rows, and a CISA table to merge into it.
+
+    Most shard rows have no icsad_ID. The CISA table holds every advisory
+    already in the shard, with the values missing from the shard, plus new ones.
+    """
+    rng = np.random.default_rng(seed)
+    num_event_rows = num_rows - num_advisories
+    primary = pd.DataFrame({
+        'event_id': np.where(rng.random(num_rows) < 0.05, np.arange(num_rows), np.nan),
+        'attribute_value': [f"10.0.{i % 256}.{i % 251}" for i in range(num_rows)],
+        'icsad_ID': np.concatenate([np.full(num_event_rows, np.nan), np.arange(1, num_advisories + 1)]),
+    })
+    advisory_ids = np.arange(1, num_advisories + num_new + 1)
+    secondary = pd.DataFrame({'icsad_ID': advisory_ids})
+    for column in ADVISORY_COLUMNS:
+        if column == 'Cumulative_CVSS':
+            secondary[column] = rng.integers(10, 100, len(advisory_ids)) / 10
+        else:
+            secondary[column] = [f"{column} {advisory_id}" for advisory_id in advisory_ids]
+        # The shard already has about half of each advisory's values
+        known = np.concatenate([np.full(num_event_rows, np.nan), np.where(rng.random(num_advisories) < 0.5, secondary[column][:num_advisories], np.nan)])
+        primary[column] = pd.Series(known, dtype=secondary[column].dtype if column == 'Cumulative_CVSS' else object)
+    return primary, secondary
+
+def merge_path(primary_data, secondary_data):
+    """Combine the tables the way ICS_Merging_To_CSV.append_data did before the upsert engine."""
+    combined_data = primary_data.merge(secondary_data, on='icsad_ID', how='outer', suffixes=('', '_new'))
+    for column in combined_data.columns:
+        if column.endswith('_new'):
+            original_column = column[:-4]
+            combined_data[original_column] = combined_data[original_column].combine_first(combined_data[column])
+            combined_data.drop(columns=[column], inplace=True)
+    return combined_data[primary_data.columns]
+
+def benchmark(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+if __name__ == '__main__':
+    for num_rows, num_advisories, num_new in [(100000, 3000, 200), (1000000, 3000, 200)]:
+        primary, secondary = make_tables(num_rows, num_advisories, num_new)
+        old_df, old_seconds = benchmark(merge_path, primary, secondary)
+        (new_df, stats), new_seconds = benchmark(upsert, primary, secondary, 'icsad_ID')
+
+        # Both paths must produce the same rows in the same order
+        pd.testing.assert_frame_equal(old_df.reset_index(drop=True), new_df, check_dtype=False)
+
+        print(f"{num_rows:,} rows, {len(secondary):,} advisories: {stats['inserted']} inserted, {stats['updated']} updated")
+        print(f"  merge + combine_first: {old_seconds:.2f}s")
+        print(f"  upsert:                {new_seconds:.2f}s")
+        print(f"  Speed-up: {old_seconds / new_seconds:.1f}x")
@@ -1,38 +1,19 @@
 import os
-import chardet
-
-def detect_encoding(file_path, sample_size=10000):
-    """Detect the encoding of a file."""
-    with open(file_path, 'rb') as f:
-        raw_data = f.read(sample_size)
-        result = chardet.detect(raw_data)
-        return result['encoding']
+from Encoding import detect_encodings
 
 def check_file_encodings(directory='.'):
-    """Check the encoding of all files in the directory."""
-    files = os.listdir(directory)
-    encoding_results = []
-
-    for filename in files:
-        file_path = os.path.join(directory, filename)
-        if os.path.isfile(file_path):
-            try:
-                encoding = detect_encoding(file_path)
-                encoding_results.append({
-                    'Filename': filename,
-                    'Encoding': encoding
-                })
-            except Exception as e:
-                encoding_results.append({
-                    'Filename': filename,
-                    'Encoding': f"Error: {str(e)}"
-                })
+    """Check the encoding of all files in the directory, detecting them in parallel."""
+    files = sorted(os.listdir(directory))
+    file_paths = [os.path.join(directory, filename) for filename in files if os.path.isfile(os.path.join(directory, filename))]
+    encodings = detect_encodings(file_paths)
+    encoding_results = [{'Filename': os.path.basename(file_path), 'Encoding': encoding} for file_path, encoding in encodings.items()]
 
     # Output the results to the console
     print("Encoding Results:")
     for result in encoding_results:
         print(f"{result['Filename']}: {result['Encoding']}")
 
-# Specify the directory you want to check
-directory_to_check = './official'  # Change this to your desired directory
-check_file_encodings(directory_to_check)
+if __name__ == '__main__':
+    # Specify the directory you want to check
+    directory_to_check = './official'  # Change this to your desired directory
+    check_file_encodings(directory_to_check)
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from FillingValues import fill_shards
+from ShardManifest import refresh_manifest
+
+def check_attribute_fill():
+    """Fill a masked shard pair in a temporary directory and check the result.
+
+    The first event's attribute_timestamp is [NaN, 't1', NaN, NaN]: its
+    attributes after 't1' must take 't1', as the original script filled them,
+    while ids and the tag row after the attributes stay empty. The second event
+    is split across the two shards, so its attributes in the second shard
+    continue from the first.
+    """
+    first = pd.DataFrame({
+        'event_id': [1, np.nan, np.nan, np.nan, np.nan, np.nan, 2, np.nan],
+        'info': ['first', np.nan, np.nan, np.nan, np.nan, np.nan, 'second', np.nan],
+        'id': [np.nan, 10, 11, 12, 13, 5, np.nan, 20],
+        'attribute_timestamp': [np.nan, np.nan, 't1', np.nan, np.nan, np.nan, np.nan, 't2'],
+        'name': [np.nan, np.nan, np.nan, np.nan, np.nan, 'tlp:white', np.nan, np.nan],
+    })
+    second = pd.DataFrame({
+        'event_id': [np.nan, 3],
+        'info': [np.nan, 'third'],
+        'id': [21, np.nan],
+        'attribute_timestamp': [np.nan, np.nan],
+        'name': [np.nan, np.nan],
+    })
+    with tempfile.TemporaryDirectory() as directory:
+        csv_files = [os.path.join(directory, 'official_part_1.csv'), os.path.join(directory, 'official_part_2.csv')]
+        first.to_csv(csv_files[0], index=False)
+        second.to_csv(csv_files[1], index=False)
+        manifest = refresh_manifest(csv_files, directory)
+        fill_shards(csv_files, manifest, {}, directory)
+        first = pd.read_csv(csv_files[0])
+        second = pd.read_csv(csv_files[1])
+
+    # The event's own row, its four attributes, its tag, then the start of the second event
+    expected = [None, None, 't1', 't1', 't1', None, None, 't2']
+    assert first['attribute_timestamp'].where(first['attribute_timestamp'].notna(), None).tolist() == expected, first['attribute_timestamp'].tolist()
+    assert first['info'].tolist() == ['first'] * 6 + ['second'] * 2, first['info'].tolist()
+    assert first['id'].isna().tolist() == [True, False, False, False, False, False, True, False], first['id'].tolist()
+    assert second['attribute_timestamp'].tolist()[0] == 't2' and pd.isna(second['attribute_timestamp'].iloc[1]), second['attribute_timestamp'].tolist()
+    assert second['info'].tolist() == ['second', 'third'], second['info'].tolist()
+    print("Attribute columns are filled within each event's attributes only")
+
+if __name__ == '__main__':
+    check_attribute_fill()
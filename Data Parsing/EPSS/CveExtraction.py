@@ -0,0 +1,32 @@
+import pandas as pd
+
+CVE_PATTERN = r'(CVE-\d{4}-\d{4,7})'
+
+# The only columns of a shard that hold CVE IDs
+CVE_COLUMNS = ['CVE_Number', 'attribute_value', 'info']
+
+def extract_row_cves(df, columns=CVE_COLUMNS):
+    """Return the row -> CVE mapping of a shard: one ('row', 'cve') pair per distinct CVE of a row.
+
+    Each column is searched with vectorized string operations, and only its
+    values that contain 'CVE-' are run through the regex. Pairs are ordered by
+    row, then by column and position within the row, like reading the row
+    left to right.
+    """
+    parts = []
+    for order, column in enumerate(column for column in df.columns if column in columns):
+        values = df[column].dropna().astype(str)
+        values = values[values.str.contains('CVE-', regex=False)]
+        if values.empty:
+            continue
+        found = values.str.extractall(CVE_PATTERN)[0]
+        parts.append(pd.DataFrame({
+            'row': found.index.get_level_values(0),
+            'order': order,
+            'match': found.index.get_level_values(1),
+            'cve': found.to_numpy()
+        }))
+    if not parts:
+        return pd.DataFrame({'row': pd.Series(dtype=df.index.dtype), 'cve': pd.Series(dtype=object)})
+    row_cves = pd.concat(parts, ignore_index=True).sort_values(['row', 'order', 'match'], kind='stable')
+    return row_cves.drop_duplicates(subset=['row', 'cve'])[['row', 'cve']].reset_index(drop=True)
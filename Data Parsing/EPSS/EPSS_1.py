@@ -1,35 +1,32 @@
 import requests
 import pandas as pd
-import re
-from datetime import datetime
 import os
+import sys
+
+# The sidecar module lives one directory up, in Data Parsing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Sidecars import is_key_column, remove_sidecar, row_keys
+from CveExtraction import CVE_COLUMNS, extract_row_cves
+from EpssTables import known_cves, load_scores, save_links, save_scores, shard_links, upsert_scores
+from EpssSnapshot import open_snapshot, snapshot_scores
+from EpssHistory import append_scores, append_snapshot
 
 def extract_cves_from_csv(file_path):
     try:
-        df = pd.read_csv(file_path, low_memory=False, on_bad_lines='skip')
-        # Ensure columns exist
-        for column in ['EPSS Scores', 'Percentiles', 'Dates']:
-            if column not in df.columns:
-                df[column] = pd.NA
+        # Only the columns that can hold CVEs, and the row keys the links are stored under
+        usecols = lambda column: column in CVE_COLUMNS or is_key_column(column)
+        df = pd.read_csv(file_path, usecols=usecols, low_memory=False, on_bad_lines='skip')
     except Exception as e:
         print(f"Failed to read {file_path} due to: {str(e)}")
         return None
-
     return df
 
-def extract_and_filter_cves(df):
-    cve_pattern = r'CVE-\d{4}-\d{4,7}'
-    cve_list = set()
-    for index, row in df.iterrows():
-        found_cves = re.findall(cve_pattern, row.to_string())
-        if found_cves:
-            existing_scores = str(row['EPSS Scores'])
-            for cve in found_cves:
-                if cve not in existing_scores:
-                    cve_list.add(cve)
-    return list(cve_list)
+def extract_and_filter_cves(links, scores):
+    # CVEs of the shard that the score table has no score or recent empty lookup for
+    cves = links['cve'].drop_duplicates()
+    return cves[~cves.isin(known_cves(scores))].tolist()
 
-def query_epss_api(cve_list, batch_size=50):
+def query_epss_api(cve_list, batch_size=50, session=None):
     if not cve_list:
         print("No CVEs to query. Skipping API calls.")
         return {}, {'total': 0, 'successful': 0, 'failed': 0}
@@ -40,7 +37,7 @@ def query_epss_api(cve_list, batch_size=50):
 
     for i in range(0, len(cve_list), batch_size):
         batch = cve_list[i:i+batch_size]
-        response = requests.get(url, params={'cve': ','.join(batch)})
+        response = (session or requests).get(url, params={'cve': ','.join(batch)})
         stats['total'] += len(batch)
 
         if response.status_code == 200:
@@ -53,56 +50,54 @@ def query_epss_api(cve_list, batch_size=50):
                         'date': item.get('date', '')
                     }
                     stats['successful'] += 1
+                # CVEs left out of a successful response have no score, e.g. reserved or rejected IDs
+                for cve in batch:
+                    epss_scores.setdefault(cve, {'epss': '', 'percentile': '', 'date': ''})
         else:
             stats['failed'] += len(batch)
 
     return epss_scores, stats
 
-def format_date(date_str):
-    try:
-        return datetime.strptime(date_str, '%Y-%m-%d').strftime('%d/%m/%Y')
-    except ValueError:
-        return date_str
-
-def append_scores_to_csv(df, epss_scores, file_path):
-    for index, row in df.iterrows():
-        found_cves = re.findall(r'CVE-\d{4}-\d{4,7}', row.to_string())
-        for cve in found_cves:
-            data = epss_scores.get(cve, {'epss': '', 'percentile': '', 'date': ''})
-
-            if pd.isna(df.at[index, 'EPSS Scores']):
-                df.at[index, 'EPSS Scores'] = f"{cve}:{data['epss']}"
-            else:
-                df.at[index, 'EPSS Scores'] += f", {cve}:{data['epss']}"
-
-            if pd.isna(df.at[index, 'Percentiles']):
-                df.at[index, 'Percentiles'] = f"{cve}:{data['percentile']}"
-            else:
-                df.at[index, 'Percentiles'] += f", {cve}:{data['percentile']}"
-
-            if pd.isna(df.at[index, 'Dates']):
-                df.at[index, 'Dates'] = f"{cve}:{format_date(data['date'])}"
-            else:
-                df.at[index, 'Dates'] += f", {cve}:{format_date(data['date'])}"
-
-    df.to_csv(file_path, index=False)
-    print("CSV file updated.")
+def resolve_epss(cve_list, snapshot, session=None):
+    # The ingested daily snapshot answers most CVEs without a network call, the API only gets the rest
+    epss_scores, missing = snapshot_scores(snapshot, cve_list)
+    api_scores, stats = query_epss_api(missing, session=session)
+    epss_scores.update(api_scores)
+    stats['snapshot'] = len(cve_list) - len(missing)
+    return epss_scores, stats
 
 def print_summary(stats, file_path):
     print(f"Processing file: {file_path}")
     print("Summary of EPSS Queries:")
+    print(f"Found in the EPSS snapshot: {stats['snapshot']}")
     print(f"Total CVEs queried: {stats['total']}")
     print(f"Successfully queried: {stats['successful']}")
     print(f"Failed to query: {stats['failed']}")
 
 # Main processing flow
 file_path = 'official_part_11.csv'
+# FIRST's daily table, e.g. epss_scores-current.csv.gz; it is ingested once and looked up locally
+snapshot_path = 'epss_scores-current.csv.gz'
+snapshot = open_snapshot(snapshot_path)
+session = requests.Session()
+directory = os.path.dirname(file_path) or '.'
+# Every day's scores are kept in epss_history/ for trend queries
+history_dir = os.path.join(directory, 'epss_history')
+if snapshot is not None:
+    append_snapshot(history_dir, snapshot)
+scores = load_scores(directory)
 original_df = extract_cves_from_csv(file_path)
 if original_df is not None:
-    cve_ids = extract_and_filter_cves(original_df)
+    # CVEs are extracted once, for both the query and the links to the score table
+    links = shard_links(row_keys(original_df, file_path), extract_row_cves(original_df))
+    cve_ids = extract_and_filter_cves(links, scores)
     if cve_ids:
-        epss_results, statistics = query_epss_api(cve_ids)
-        append_scores_to_csv(original_df, epss_results, file_path)
+        epss_results, statistics = resolve_epss(cve_ids, snapshot, session)
+        save_scores(upsert_scores(scores, epss_results), directory)
+        append_scores(history_dir, epss_results)
         print_summary(statistics, file_path)
     else:
-        print("No new CVEs to query. All necessary data is already in the CSV.")
+        print("No new CVEs to query. All necessary data is already in the score table.")
+    save_links(links, directory, file_path)
+    # Scores used to be written into sidecars/epss/; the links replace them, so they are no longer joined in
+    remove_sidecar(file_path, 'epss')
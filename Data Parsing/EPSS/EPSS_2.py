@@ -2,8 +2,18 @@ import requests
 import pandas as pd
 import re
 import os
-from datetime import datetime
 import glob
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# The shard manifest and sidecar modules live one directory up, in Data Parsing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ShardManifest import is_enriched, mark_enriched, refresh_manifest
+from Sidecars import is_key_column, remove_sidecar, row_keys
+from CveExtraction import CVE_COLUMNS, extract_row_cves
+from EpssTables import known_cves, load_links, load_scores, save_links, save_scores, shard_links, upsert_scores
+from EpssSnapshot import open_snapshot, snapshot_scores
+from EpssHistory import append_scores, append_snapshot
 
 def find_and_sort_csv_files(directory='.', pattern='official_part_*.csv'):
     """ Find and sort CSV files by the numeric part of their filename. """
@@ -13,28 +23,20 @@ def find_and_sort_csv_files(directory='.', pattern='official_part_*.csv'):
 
 def extract_cves_from_csv(file_path):
     try:
-        df = pd.read_csv(file_path, low_memory=False, on_bad_lines='skip')
-        for column in ['EPSS Scores', 'Percentiles', 'Dates']:
-            if column not in df.columns:
-                df[column] = pd.NA
+        # Only the columns that can hold CVEs, and the row keys the links are stored under
+        usecols = lambda column: column in CVE_COLUMNS or is_key_column(column)
+        df = pd.read_csv(file_path, usecols=usecols, low_memory=False, on_bad_lines='skip')
     except Exception as e:
         print(f"Failed to read {file_path} due to: {str(e)}")
         return None
     return df
 
-def extract_and_filter_cves(df):
-    cve_pattern = r'CVE-\d{4}-\d{4,7}'
-    cve_list = set()
-    for index, row in df.iterrows():
-        found_cves = re.findall(cve_pattern, row.to_string())
-        if found_cves:
-            existing_scores = str(row['EPSS Scores'])
-            for cve in found_cves:
-                if cve not in existing_scores:
-                    cve_list.add(cve)
-    return list(cve_list)
+def extract_and_filter_cves(links, scores):
+    # CVEs of the shard that the score table has no score or recent empty lookup for
+    cves = links['cve'].drop_duplicates()
+    return cves[~cves.isin(known_cves(scores))].tolist()
 
-def query_epss_api(cve_list, batch_size=50):
+def query_epss_api(cve_list, batch_size=50, session=None):
     if not cve_list:
         print("No CVEs to query. Skipping API calls.")
         return {}, {'total': 0, 'successful': 0, 'failed': 0}
@@ -43,7 +45,7 @@ def query_epss_api(cve_list, batch_size=50):
     url = "https://api.first.org/data/v1/epss"
     for i in range(0, len(cve_list), batch_size):
         batch = cve_list[i:i+batch_size]
-        response = requests.get(url, params={'cve': ','.join(batch)})
+        response = (session or requests).get(url, params={'cve': ','.join(batch)})
         stats['total'] += len(batch)
         if response.status_code == 200:
             data = response.json()
@@ -55,52 +57,102 @@ def query_epss_api(cve_list, batch_size=50):
                         'date': item.get('date', '')
                     }
                     stats['successful'] += 1
+                # CVEs left out of a successful response have no score, e.g. reserved or rejected IDs
+                for cve in batch:
+                    epss_scores.setdefault(cve, {'epss': '', 'percentile': '', 'date': ''})
         else:
             stats['failed'] += len(batch)
     return epss_scores, stats
 
-def format_date(date_str):
-    try:
-        return datetime.strptime(date_str, '%Y-%m-%d').strftime('%d/%m/%Y')
-    except ValueError:
-        return date_str
+def resolve_epss(cve_list, snapshot, session=None):
+    # The ingested daily snapshot answers most CVEs without a network call, the API only gets the rest
+    epss_scores, missing = snapshot_scores(snapshot, cve_list)
+    api_scores, stats = query_epss_api(missing, session=session)
+    epss_scores.update(api_scores)
+    stats['snapshot'] = len(cve_list) - len(missing)
+    return epss_scores, stats
+
+def collect_shard_cves(file_path):
+    """Phase one for a single shard: its row <-> CVE links, or None if it could not be read."""
+    df = extract_cves_from_csv(file_path)
+    if df is None:
+        return None
+    return shard_links(row_keys(df, file_path), extract_row_cves(df))
 
-def append_scores_to_csv(df, epss_scores, file_path):
-    for index, row in df.iterrows():
-        found_cves = re.findall(r'CVE-\d{4}-\d{4,7}', row.to_string())
-        for cve in found_cves:
-            data = epss_scores.get(cve, {'epss': '', 'percentile': '', 'date': ''})
-            if pd.isna(df.at[index, 'EPSS Scores']):
-                df.at[index, 'EPSS Scores'] = f"{cve}:{data['epss']}"
-            else:
-                df.at[index, 'EPSS Scores'] += f", {cve}:{data['epss']}"
-            if pd.isna(df.at[index, 'Percentiles']):
-                df.at[index, 'Percentiles'] = f"{cve}:{data['percentile']}"
-            else:
-                df.at[index, 'Percentiles'] += f", {cve}:{data['percentile']}"
-            if pd.isna(df.at[index, 'Dates']):
-                df.at[index, 'Dates'] = f"{cve}:{format_date(data['date'])}"
-            else:
-                df.at[index, 'Dates'] += f", {cve}:{format_date(data['date'])}"
-    df.to_csv(file_path, index=False)
-    print("CSV file updated.")
+def collect_cves(file_paths, workers=None):
+    """Run phase one over all shards in parallel, one process per core by default."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(file_paths, executor.map(collect_shard_cves, file_paths)))
 
-def print_summary(stats, file_path):
-    print(f"Processing file: {file_path}")
+def print_summary(stats, label):
+    print(f"Processed {label}")
     print("Summary of EPSS Queries:")
+    print(f"Found in the EPSS snapshot: {stats['snapshot']}")
     print(f"Total CVEs queried: {stats['total']}")
     print(f"Successfully queried: {stats['successful']}")
     print(f"Failed to query: {stats['failed']}")
 
+def print_dedup_report(shard_cves, distinct_cves):
+    requested = sum(len(cve_ids) for cve_ids in shard_cves.values())
+    print("Summary of CVE deduplication:")
+    print(f"Shards with unscored CVEs: {sum(1 for cve_ids in shard_cves.values() if cve_ids)}")
+    print(f"CVE lookups needed shard by shard: {requested}")
+    print(f"Distinct CVEs looked up: {len(distinct_cves)}")
+    print(f"Duplicate lookups avoided: {requested - len(distinct_cves)}")
+
 # Main processing flow
-file_paths = find_and_sort_csv_files()  # Adjust the directory if needed
-for file_path in file_paths:
-    original_df = extract_cves_from_csv(file_path)
-    if original_df is not None:
-        cve_ids = extract_and_filter_cves(original_df)
-        if cve_ids:
-            epss_results, statistics = query_epss_api(cve_ids)
-            append_scores_to_csv(original_df, epss_results, file_path)
-            print_summary(statistics, file_path)
+if __name__ == '__main__':
+    directory = '.'  # Adjust the directory if needed
+    workers = None  # Processes used to collect CVEs, one per core by default
+    # FIRST's daily table, e.g. epss_scores-current.csv.gz; it is ingested once and looked up locally
+    snapshot_path = os.path.join(directory, 'epss_scores-current.csv.gz')
+    snapshot = open_snapshot(snapshot_path, os.path.join(directory, 'epss_snapshot'))
+    # Every day's scores are kept in epss_history/ for trend queries
+    history_dir = os.path.join(directory, 'epss_history')
+    if snapshot is not None:
+        append_snapshot(history_dir, snapshot)
+    session = requests.Session()
+    file_paths = find_and_sort_csv_files(directory)
+    manifest = refresh_manifest(file_paths, directory)
+    scores = load_scores(directory)
+
+    # Shards scored since they last changed are skipped without being parsed
+    pending_files = []
+    for file_path in file_paths:
+        if is_enriched(manifest, file_path, 'epss'):
+            print(f"EPSS scores already up to date in {file_path}")
+        else:
+            pending_files.append(file_path)
+
+    # Phase one: the row <-> CVE links of all shards, collected in parallel,
+    # and the distinct CVEs among them that have no score yet
+    links = collect_cves(pending_files, workers) if pending_files else {}
+    links = {file_path: shard_links for file_path, shard_links in links.items() if shard_links is not None}
+    shard_cves = {file_path: extract_and_filter_cves(shard_links, scores) for file_path, shard_links in links.items()}
+    # Shards already scored are not parsed again, but their CVEs that had no score are
+    # looked up again from their saved links once UNSCORED_TTL has passed
+    scored_files = {os.path.basename(file_path): file_path for file_path in file_paths if file_path not in pending_files}
+    saved_links = load_links(directory)
+    for shard_name, shard_links in saved_links[saved_links['shard'].isin(scored_files)].groupby('shard'):
+        shard_cves[scored_files[shard_name]] = extract_and_filter_cves(shard_links, scores)
+    distinct_cves = list(dict.fromkeys(cve for cve_ids in shard_cves.values() for cve in cve_ids))
+
+    # Phase two: every CVE is resolved once into the score table, which all shards link to
+    if distinct_cves:
+        epss_results, statistics = resolve_epss(distinct_cves, snapshot, session)
+        scores = upsert_scores(scores, epss_results)
+        save_scores(scores, directory)
+        append_scores(history_dir, epss_results)
+        print_summary(statistics, f"{sum(1 for cve_ids in shard_cves.values() if cve_ids)} shards")
+    else:
+        print("No new CVEs to query. All necessary data is already in the score table.")
+    for file_path, shard_links in links.items():
+        save_links(shard_links, directory, file_path)
+        # Scores used to be written into sidecars/epss/; the links replace them, so they are no longer joined in
+        remove_sidecar(file_path, 'epss')
+        # A shard with CVEs whose lookup failed is collected again next run
+        if shard_links['cve'].isin(known_cves(scores)).all():
+            mark_enriched(manifest, file_path, 'epss', directory)
         else:
-            print("No new CVEs to query. All necessary data is already in the CSV.")
+            print(f"Some CVEs in {file_path} could not be looked up, it will be retried next run")
+    print_dedup_report(shard_cves, distinct_cves)
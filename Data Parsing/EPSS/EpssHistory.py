@@ -0,0 +1,174 @@
+import calendar
+import json
+import os
+import numpy as np
+import pandas as pd
+from EpssSnapshot import cve_keys
+
+METRICS = ['epss', 'percentile']
+
+def cve_names(keys):
+    """Turn int64 CVE keys back into 'CVE-YYYY-NNNN' IDs."""
+    return [f"CVE-{key // 10**8}-{key % 10**8:04d}" for key in np.asarray(keys).tolist()]
+
+def meta_path(history_dir):
+    return os.path.join(history_dir, 'meta.json')
+
+def chunk_path(history_dir, month, metric):
+    """Each month of a metric is one (days in month x CVEs) float32 array, e.g. 2024-01.epss.npy."""
+    return os.path.join(history_dir, f"{month}.{metric}.npy")
+
+def load_meta(history_dir):
+    if not os.path.exists(meta_path(history_dir)):
+        return {'dates': []}
+    with open(meta_path(history_dir), 'r') as file:
+        return json.load(file)
+
+def save_meta(meta, history_dir):
+    with open(meta_path(history_dir) + '.tmp', 'w') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(meta_path(history_dir) + '.tmp', meta_path(history_dir))
+
+def load_cve_index(history_dir):
+    """CVE keys in the order their columns were added; a CVE keeps its column in every chunk."""
+    path = os.path.join(history_dir, 'cves.npy')
+    return np.load(path) if os.path.exists(path) else np.zeros(0, dtype='int64')
+
+def save_cve_index(keys, history_dir):
+    path = os.path.join(history_dir, 'cves.npy')
+    with open(path + '.tmp', 'wb') as file:
+        np.save(file, keys)
+    os.replace(path + '.tmp', path)
+
+def column_positions(index_keys, keys):
+    """Column of each key in the CVE index, or -1 for keys it does not have."""
+    order = np.argsort(index_keys, kind='stable')
+    sorted_keys = index_keys[order]
+    positions = np.searchsorted(sorted_keys, keys).clip(max=max(len(sorted_keys) - 1, 0))
+    found = (sorted_keys[positions] == keys) if len(sorted_keys) else np.zeros(len(keys), dtype=bool)
+    return np.where(found, order[positions] if len(sorted_keys) else -1, -1)
+
+def open_chunk(history_dir, month, metric, columns):
+    """Memory-map a month chunk for writing, growing it when it has fewer than columns CVEs.
+
+    Chunks are allocated with spare columns, so new CVEs usually fit without
+    the chunk being copied.
+    """
+    path = chunk_path(history_dir, month, metric)
+    days = calendar.monthrange(int(month[:4]), int(month[5:7]))[1]
+    if os.path.exists(path):
+        chunk = np.load(path, mmap_mode='r+')
+        if chunk.shape[1] >= columns:
+            return chunk
+        del chunk
+    capacity = max(1024, int(columns * 1.25))
+    grown = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype='float32', shape=(days, capacity))
+    grown[:] = np.nan
+    if os.path.exists(path):
+        old = np.load(path, mmap_mode='r')
+        grown[:, :old.shape[1]] = old
+        del old
+    grown.flush()
+    del grown
+    os.replace(path + '.tmp', path)
+    return np.load(path, mmap_mode='r+')
+
+def append_day(history_dir, date, keys, epss, percentile):
+    """Record one day's scores for the given CVE keys; other CVEs of that day are left as they are.
+
+    Only the day's row of the month chunk is written, in place.
+    """
+    os.makedirs(history_dir, exist_ok=True)
+    date = pd.Timestamp(date)
+    keys = np.asarray(keys, dtype='int64')
+    index_keys = load_cve_index(history_dir)
+    positions = column_positions(index_keys, keys)
+    new_keys = np.unique(keys[positions < 0])
+    if len(new_keys):
+        index_keys = np.concatenate([index_keys, new_keys])
+        save_cve_index(index_keys, history_dir)
+        positions = column_positions(index_keys, keys)
+    month = date.strftime('%Y-%m')
+    for metric, values in zip(METRICS, [epss, percentile]):
+        chunk = open_chunk(history_dir, month, metric, len(index_keys))
+        chunk[date.day - 1, positions] = np.asarray(values, dtype='float32')
+        chunk.flush()
+        del chunk
+    meta = load_meta(history_dir)
+    meta['dates'] = sorted(set(meta['dates']) | {date.strftime('%Y-%m-%d')})
+    save_meta(meta, history_dir)
+
+def append_snapshot(history_dir, snapshot):
+    """Add an ingested EpssSnapshot table as its score date, unless that day is already recorded."""
+    date = snapshot['meta']['date']
+    if date is None or date in load_meta(history_dir)['dates']:
+        return False
+    append_day(history_dir, date, snapshot['keys'], snapshot['epss'], snapshot['percentile'])
+    print(f"Added the EPSS scores of {date} to the history")
+    return True
+
+def append_scores(history_dir, epss_scores):
+    """Add results in query_epss_api's {cve: {'epss', 'percentile', 'date'}} form, one write per date."""
+    scores = pd.DataFrame.from_dict(epss_scores, orient='index', columns=['epss', 'percentile', 'date'])
+    scores = scores.replace('', np.nan).dropna()
+    for date, day in scores.groupby('date'):
+        append_day(history_dir, date, cve_keys(day.index), day['epss'].astype('float32'), day['percentile'].astype('float32'))
+
+def load_history(history_dir, metric='epss', cves=None, start=None, end=None):
+    """Load a metric as a (days x CVEs) float32 matrix between start and end, both inclusive.
+
+    Returns the dates, the CVE keys of the columns and the matrix. Only the
+    chunks of the months in range are read, and only the given CVEs' columns
+    if cves is set. Days or CVEs without a score are NaN.
+    """
+    dates = pd.to_datetime(load_meta(history_dir)['dates'])
+    index_keys = load_cve_index(history_dir)
+    if start is not None:
+        dates = dates[dates >= pd.Timestamp(start)]
+    if end is not None:
+        dates = dates[dates <= pd.Timestamp(end)]
+    keys = index_keys if cves is None else cve_keys(cves)
+    columns = column_positions(index_keys, keys)
+    matrix = np.full((len(dates), len(keys)), np.nan, dtype='float32')
+    for month, rows in pd.Series(np.arange(len(dates)), index=dates).groupby(dates.strftime('%Y-%m')):
+        chunk = np.load(chunk_path(history_dir, month, metric), mmap_mode='r')
+        # Columns of CVEs added after the chunk was last written stay NaN
+        present = (columns >= 0) & (columns < chunk.shape[1])
+        matrix[np.ix_(rows.to_numpy(), present.nonzero()[0])] = chunk[np.ix_(rows.index.day.to_numpy() - 1, columns[present])]
+    return dates, keys, matrix
+
+def deltas(matrix, days=1):
+    """Change of every CVE's score over the last `days` recorded days."""
+    if len(matrix) <= days:
+        return np.full(matrix.shape[1], np.nan, dtype='float32')
+    return matrix[-1] - matrix[-1 - days]
+
+def slopes(dates, matrix):
+    """Least-squares slope per day of every CVE's score, skipping the days it has no score on."""
+    x = ((dates - dates[0]).days.to_numpy(dtype='float64'))[:, None]
+    valid = ~np.isnan(matrix)
+    y = np.where(valid, matrix, 0).astype('float64')
+    n = valid.sum(axis=0)
+    sum_x = (x * valid).sum(axis=0)
+    sum_y = y.sum(axis=0)
+    sum_xx = (x * x * valid).sum(axis=0)
+    sum_xy = (x * y).sum(axis=0)
+    denominator = n * sum_xx - sum_x ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((n >= 2) & (denominator > 0), (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+
+def rising_fastest(history_dir, top=20, days=30, metric='epss', cves=None):
+    """The CVEs whose score rose fastest over the last `days` days, steepest slope first."""
+    dates = pd.to_datetime(load_meta(history_dir)['dates'])
+    if len(dates) == 0:
+        return pd.DataFrame(columns=['cve', 'slope', 'change', 'latest'])
+    dates, keys, matrix = load_history(history_dir, metric, cves, start=dates[-1] - pd.Timedelta(days=days))
+    slope = slopes(dates, matrix)
+    ranked = np.argsort(np.where(np.isnan(slope), -np.inf, slope))[::-1][:top]
+    ranked = ranked[~np.isnan(slope[ranked])]
+    return pd.DataFrame({
+        'cve': cve_names(keys[ranked]),
+        'slope': slope[ranked],
+        'change': deltas(matrix, len(dates) - 1)[ranked],
+        'latest': matrix[-1, ranked]
+    })
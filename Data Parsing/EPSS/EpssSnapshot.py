@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_ARRAYS = ['keys', 'epss', 'percentile']
+
+def cve_keys(cves):
+    """Encode 'CVE-YYYY-NNNN' IDs as int64 YYYY * 10^8 + NNNN so they sort and search as numbers.
+
+    IDs that do not parse get -1, which no snapshot key equals.
+    """
+    parts = pd.Series(cves, dtype=object).str.extract(r'^CVE-(\d{4})-(\d{4,7})$')
+    keys = pd.to_numeric(parts[0]) * 10**8 + pd.to_numeric(parts[1])
+    return keys.fillna(-1).astype('int64').to_numpy()
+
+def snapshot_date(snapshot_path):
+    """Score date from the '#model_version:...,score_date:YYYY-MM-DDT...' line heading FIRST's daily file.
+
+    Files without that line, e.g. ones saved without their comment header,
+    are dated by their modification time.
+    """
+    opener = gzip.open if snapshot_path.endswith('.gz') else open
+    with opener(snapshot_path, 'rt') as file:
+        first_line = file.readline().strip()
+    if first_line.startswith('#'):
+        for field in first_line.lstrip('#').split(','):
+            name, _, value = field.partition(':')
+            if name == 'score_date':
+                return value[:10]
+    date = pd.Timestamp(os.path.getmtime(snapshot_path), unit='s').strftime('%Y-%m-%d')
+    print(f"No score_date in {snapshot_path}, dating its scores {date} from the file's modification time")
+    return date
+
+def ingest_snapshot(snapshot_path, snapshot_dir='epss_snapshot'):
+    """Turn FIRST's daily epss_scores CSV (gzip or plain) into arrays sorted by CVE key.
+
+    keys.npy holds int64 CVE keys, epss.npy and percentile.npy float32 scores,
+    and meta.json the score date and the file they came from. The arrays are
+    replaced one by one and the metadata last, so a half-finished ingest is
+    never mistaken for a finished one.
+    """
+    date = snapshot_date(snapshot_path)
+    scores = pd.read_csv(snapshot_path, comment='#', usecols=['cve', 'epss', 'percentile'])
+    keys = cve_keys(scores['cve'])
+    order = np.argsort(keys, kind='stable')
+    arrays = {
+        'keys': keys[order],
+        'epss': scores['epss'].to_numpy(dtype='float32')[order],
+        'percentile': scores['percentile'].to_numpy(dtype='float32')[order]
+    }
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta_path = os.path.join(snapshot_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, array in arrays.items():
+        path = os.path.join(snapshot_dir, name + '.npy')
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, array)
+        os.replace(path + '.tmp', path)
+    stat = os.stat(snapshot_path)
+    with open(meta_path + '.tmp', 'w') as file:
+        json.dump({'date': date, 'rows': len(keys), 'source': os.path.basename(snapshot_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, file, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    print(f"Ingested {len(keys)} EPSS scores dated {date} from {snapshot_path}")
+
+def load_snapshot(snapshot_dir='epss_snapshot'):
+    """Memory-map the ingested arrays; returns None if no snapshot has been ingested."""
+    meta_path = os.path.join(snapshot_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as file:
+        snapshot = {'meta': json.load(file)}
+    for name in SNAPSHOT_ARRAYS:
+        snapshot[name] = np.load(os.path.join(snapshot_dir, name + '.npy'), mmap_mode='r')
+    return snapshot
+
+def open_snapshot(snapshot_path=None, snapshot_dir='epss_snapshot'):
+    """Ingest snapshot_path if it is newer than the ingested table, then load the table."""
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        snapshot = load_snapshot(snapshot_dir)
+        stat = os.stat(snapshot_path)
+        # Snapshots ingested without a date are ingested again so their scores can be used
+        if snapshot is None or snapshot['meta']['date'] is None or (snapshot['meta']['size'], snapshot['meta']['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            ingest_snapshot(snapshot_path, snapshot_dir)
+    return load_snapshot(snapshot_dir)
+
+def lookup_snapshot(snapshot, cves):
+    """Look CVEs up in the snapshot with one vectorized binary search.
+
+    Returns a DataFrame indexed like cves with found, epss, percentile and
+    date; CVEs missing from the snapshot are not found and get NaN.
+    """
+    keys = cve_keys(cves)
+    epss = np.full(len(keys), np.nan, dtype='float32')
+    percentile = np.full(len(keys), np.nan, dtype='float32')
+    found = np.zeros(len(keys), dtype=bool)
+    if len(snapshot['keys']):
+        positions = np.searchsorted(snapshot['keys'], keys).clip(max=len(snapshot['keys']) - 1)
+        found = snapshot['keys'][positions] == keys
+        epss[found] = snapshot['epss'][positions[found]]
+        percentile[found] = snapshot['percentile'][positions[found]]
+    return pd.DataFrame({
+        'cve': list(cves),
+        'found': found,
+        'epss': epss,
+        'percentile': percentile,
+        'date': np.where(found, snapshot['meta']['date'], None)
+    })
+
+def snapshot_scores(snapshot, cve_list):
+    """Resolve CVEs from the snapshot in the {cve: {'epss', 'percentile', 'date'}} form of query_epss_api.
+
+    Returns the scores found and the CVEs the snapshot does not have, which
+    are left for the API.
+    """
+    if snapshot is None or not cve_list:
+        return {}, list(cve_list)
+    results = lookup_snapshot(snapshot, cve_list)
+    found = results['found'].to_numpy()
+    # str() of a float32 gives its shortest form, the same digits as in FIRST's file
+    epss_scores = {
+        cve: {'epss': str(epss), 'percentile': str(percentile), 'date': date}
+        for cve, epss, percentile, date in zip(results['cve'][found], results['epss'].to_numpy()[found], results['percentile'].to_numpy()[found], results['date'][found])
+    }
+    return epss_scores, results.loc[~found, 'cve'].tolist()
@@ -0,0 +1,107 @@
+import os
+import pandas as pd
+
+# One row per CVE with its latest score and the day it was last looked up; dates are parsed on load
+SCORE_DTYPES = {'cve': 'object', 'epss': 'float32', 'percentile': 'float32'}
+SCORE_DATES = ['date', 'checked']
+
+# CVEs FIRST has no score for, e.g. reserved or rejected IDs, are looked up again after a day
+UNSCORED_TTL = pd.Timedelta(days=1)
+LINK_DTYPES = {'event_id': 'int64', 'attribute_id': 'int64', 'cve': 'object'}
+
+def tables_dir(directory='.'):
+    return os.path.join(directory, 'epss_tables')
+
+def scores_path(directory='.'):
+    return os.path.join(tables_dir(directory), 'cve_scores.csv')
+
+def links_path(directory, csv_file):
+    """Each shard's row <-> CVE links are kept in epss_tables/links/<shard name>."""
+    return os.path.join(tables_dir(directory), 'links', os.path.basename(csv_file))
+
+def load_scores(directory='.'):
+    """Load the CVE score table, indexed by CVE.
+
+    CVEs that were looked up without getting a score have an empty epss,
+    percentile and date.
+    """
+    path = scores_path(directory)
+    if not os.path.exists(path):
+        scores = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in SCORE_DTYPES.items()})
+        for column in SCORE_DATES:
+            scores[column] = pd.Series(dtype='datetime64[ns]')
+        return scores.set_index('cve')
+    scores = pd.read_csv(path, dtype=SCORE_DTYPES)
+    # Tables written before lookups were dated only hold scored CVEs, which were checked on their score's date
+    if 'checked' not in scores.columns:
+        scores['checked'] = scores['date']
+    for column in SCORE_DATES:
+        scores[column] = pd.to_datetime(scores[column], format='%Y-%m-%d')
+    return scores.set_index('cve')
+
+def save_scores(scores, directory='.'):
+    os.makedirs(tables_dir(directory), exist_ok=True)
+    path = scores_path(directory)
+    scores.reset_index().to_csv(path + '.tmp', index=False, date_format='%Y-%m-%d')
+    os.replace(path + '.tmp', path)
+
+def upsert_scores(scores, epss_scores, today=None):
+    """Add scores in query_epss_api's {cve: {'epss', 'percentile', 'date'}} form; newer results replace older ones.
+
+    CVEs answered with an empty score are kept without one, checked today, so
+    they are not looked up again until UNSCORED_TTL has passed.
+    """
+    new_scores = pd.DataFrame.from_dict(epss_scores, orient='index', columns=['epss', 'percentile', 'date'])
+    if new_scores.empty:
+        return scores
+    new_scores = new_scores.replace('', float('nan'))
+    new_scores.index.name = 'cve'
+    new_scores = new_scores.astype({'epss': 'float32', 'percentile': 'float32'})
+    new_scores['date'] = pd.to_datetime(new_scores['date'], format='%Y-%m-%d', errors='coerce')
+    new_scores['checked'] = (pd.Timestamp.today() if today is None else pd.Timestamp(today)).normalize()
+    # A lookup that came back empty never replaces a score the table already has
+    new_scores = new_scores[new_scores['epss'].notna() | ~new_scores.index.isin(scores.index[scores['epss'].notna()])]
+    return pd.concat([scores[~scores.index.isin(new_scores.index)], new_scores]).sort_index()
+
+def known_cves(scores, today=None):
+    """CVEs that need no lookup: those with a score, and those checked without one within UNSCORED_TTL."""
+    today = (pd.Timestamp.today() if today is None else pd.Timestamp(today)).normalize()
+    return scores.index[scores['epss'].notna() | (scores['checked'] > today - UNSCORED_TTL)]
+
+def shard_links(row_keys, row_cves):
+    """Turn a shard's row -> CVE mapping into link rows keyed by (event_id, attribute_id)."""
+    keys = row_keys.loc[row_cves['row']].reset_index(drop=True)
+    links = pd.DataFrame({'event_id': keys['event_id'], 'attribute_id': keys['attribute_id'], 'cve': row_cves['cve'].to_numpy()})
+    return links.dropna(subset=['event_id', 'attribute_id']).drop_duplicates().astype(LINK_DTYPES)
+
+def save_links(links, directory, csv_file):
+    """Replace a shard's links; they are rebuilt from the whole shard each time it is scored."""
+    path = links_path(directory, csv_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    links.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def load_links(directory='.'):
+    """Load the links of all shards, with the shard each row is in."""
+    links_dir = os.path.join(tables_dir(directory), 'links')
+    frames = []
+    for shard_name in sorted(os.listdir(links_dir)) if os.path.isdir(links_dir) else []:
+        links = pd.read_csv(os.path.join(links_dir, shard_name), dtype=LINK_DTYPES)
+        links.insert(0, 'shard', shard_name)
+        frames.append(links)
+    if not frames:
+        return pd.DataFrame({'shard': pd.Series(dtype='object'), **{column: pd.Series(dtype=dtype) for column, dtype in LINK_DTYPES.items()}})
+    return pd.concat(frames, ignore_index=True)
+
+def scored_links(directory='.'):
+    """Every row <-> CVE link with the CVE's epss, percentile and date."""
+    return load_links(directory).join(load_scores(directory), on='cve')
+
+def events_above_percentile(threshold=0.9, directory='.'):
+    """IDs of the events with any CVE scored above the given EPSS percentile."""
+    links = scored_links(directory)
+    return links.loc[links['percentile'] > threshold, 'event_id'].drop_duplicates().sort_values().to_numpy()
+
+def event_scores(directory='.'):
+    """Highest epss and percentile of each event's CVEs, for use as event features."""
+    return scored_links(directory).groupby('event_id')[['epss', 'percentile']].max()
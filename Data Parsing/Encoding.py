@@ -1,28 +1,166 @@
-import pandas as pd
+import codecs
+import hashlib
+import json
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+import chardet
 
-# Directory where your files are located (adjust as necessary)
-directory = '.'
+UTF8_BOM = codecs.BOM_UTF8
 
-# Compile a regex pattern to match files
-pattern = re.compile(r'official_part_\d+\.csv')
+def is_utf8(file_path, chunk_size=1 << 20):
+    """True if the whole file decodes as strict UTF-8, read chunk by chunk."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
+    try:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
 
-# List all files in the directory
-files = os.listdir(directory)
+def detect_encoding(file_path, sample_size=10000):
+    """Detect the encoding of a file.
 
-for filename in files:
-    if pattern.match(filename):
-        input_file = os.path.join(directory, filename)
-        output_file = os.path.join(directory, filename)
+    A file that decodes as UTF-8 is taken to be UTF-8. chardet often guesses a
+    single-byte encoding such as ISO-8859-1 for short UTF-8 text, and those
+    decode any bytes, so the mistake would never be noticed. Other files are
+    guessed from a sample of their first bytes.
+    """
+    with open(file_path, 'rb') as f:
+        raw_data = f.read(sample_size)
+    if raw_data.startswith(UTF8_BOM):
+        return 'utf-8-sig'
+    if is_utf8(file_path):
+        return 'utf-8'
+    encoding = chardet.detect(raw_data)['encoding']
+    return encoding.lower() if encoding else encoding
 
-        # Load the CSV with the correct encoding 'utf-8'
-        df = pd.read_csv(input_file, encoding='utf-8')
+def detect_encodings(file_paths, workers=None):
+    """Detect the encodings of several files in parallel, one process per core by default.
 
-        # Optionally, check the first few rows to make sure it reads correctly
-        print(f'Preview of {input_file}:')
-        print(df.head())
+    Returns file path -> encoding, or an 'Error: ...' string for files that
+    could not be read.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {file_path: executor.submit(detect_encoding, file_path) for file_path in file_paths}
+        for file_path, future in futures.items():
+            try:
+                results[file_path] = future.result()
+            except Exception as e:
+                results[file_path] = f"Error: {str(e)}"
+    return results
 
-        # Save the CSV with the same encoding 'utf-8-sig'
-        df.to_csv(output_file, encoding='utf-8-sig', index=False)
-        print(f'Saved re-encoded file to {output_file}')
+def file_hash(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_encoding_state(state_path):
+    """Load the filename -> {'size', 'mtime_ns', 'sha256', 'encoding'} fingerprints of normalised files."""
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+def save_encoding_state(encoding_state, state_path):
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(encoding_state, f, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+
+def fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def is_normalised(file_path, entry):
+    """True if the file is unchanged since it was normalised.
+
+    Size and mtime are compared first; the file is only hashed when they
+    differ, to tell a rewrite with the same content from a real change.
+    """
+    if entry is None:
+        return False
+    current = fingerprint(file_path)
+    if current['size'] != entry['size']:
+        return False
+    if current['mtime_ns'] == entry['mtime_ns']:
+        return True
+    if file_hash(file_path) == entry['sha256']:
+        entry['mtime_ns'] = current['mtime_ns']
+        return True
+    return False
+
+def transcode_to_utf8_sig(file_path, encoding, chunk_size=1 << 20):
+    """Rewrite a file as UTF-8 with a BOM, decoding it chunk by chunk through a temporary file."""
+    temp_path = file_path + '.tmp'
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    try:
+        with open(file_path, 'rb') as source, open(temp_path, 'wb') as target:
+            target.write(UTF8_BOM)
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                target.write(decoder.decode(chunk).encode('utf-8'))
+            target.write(decoder.decode(b'', final=True).encode('utf-8'))
+    except Exception:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, file_path)
+
+def normalise_file(file_path, encoding):
+    """Make a file UTF-8 with a BOM; files that already are are left untouched.
+
+    ASCII is a subset of UTF-8, so it is decoded as UTF-8. If the encoding
+    guessed from a sample turns out to be wrong further into the file, the
+    whole file is detected again and transcoded once more.
+    """
+    if encoding == 'utf-8-sig':
+        return encoding
+    try:
+        encoding = 'utf-8' if encoding in (None, 'ascii') else encoding
+        transcode_to_utf8_sig(file_path, encoding)
+    except UnicodeDecodeError:
+        encoding = detect_encoding(file_path, sample_size=os.path.getsize(file_path))
+        encoding = 'utf-8' if encoding in (None, 'ascii') else encoding
+        transcode_to_utf8_sig(file_path, encoding)
+    return encoding
+
+def normalise_encodings(file_paths, encoding_state, state_path, workers=None):
+    """Normalise every file not already normalised since it last changed.
+
+    Encodings are detected in parallel, then each file is transcoded. Returns
+    the number of files checked, skipped and rewritten.
+    """
+    stats = {'checked': len(file_paths), 'skipped': 0, 'rewritten': 0}
+    pending = [file_path for file_path in file_paths if not is_normalised(file_path, encoding_state.get(os.path.basename(file_path)))]
+    stats['skipped'] = len(file_paths) - len(pending)
+    for file_path, encoding in detect_encodings(pending, workers).items():
+        if encoding is not None and encoding.startswith('Error:'):
+            print(f"Could not read {file_path}: {encoding}")
+            continue
+        source_encoding = normalise_file(file_path, encoding)
+        if source_encoding != 'utf-8-sig':
+            stats['rewritten'] += 1
+            print(f'Re-encoded {file_path} from {source_encoding} to utf-8-sig')
+        encoding_state[os.path.basename(file_path)] = dict(fingerprint(file_path), sha256=file_hash(file_path), encoding=source_encoding)
+        save_encoding_state(encoding_state, state_path)
+    # Entries whose mtime moved without a change in content are saved too
+    save_encoding_state(encoding_state, state_path)
+    return stats
+
+if __name__ == '__main__':
+    # Directory where your files are located (adjust as necessary)
+    directory = '.'
+    state_path = os.path.join(directory, 'encoding_state.json')
+
+    # Compile a regex pattern to match files
+    pattern = re.compile(r'official_part_\d+\.csv')
+
+    # List all matching files in the directory
+    file_paths = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if pattern.match(filename)]
+
+    encoding_state = load_encoding_state(state_path)
+    stats = normalise_encodings(file_paths, encoding_state, state_path)
+    print(f"Files checked: {stats['checked']}, already normalised: {stats['skipped']}, re-encoded: {stats['rewritten']}")
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from TextSanitiser import clean_text_columns
+
+NESTED_KEYS = ['Attributes', 'RelatedEvents', 'Tags', 'Galaxies', 'Clusters']
+
+def flatten_nested(data, prefix, record):
+    """Flatten nested dictionaries into 'parent.child' keys in their original order."""
+    for key, value in data.items():
+        name = f"{prefix}.{key}"
+        if isinstance(value, dict):
+            flatten_nested(value, name, record)
+        else:
+            record[name] = value
+
+def flatten_record(data):
+    """Flatten one dictionary the way pd.json_normalize does for a single record.
+
+    Top-level scalar and list values keep their order and the flattened nested
+    dictionaries follow them.
+    """
+    record = {key: value for key, value in data.items() if not isinstance(value, dict)}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flatten_nested(value, key, record)
+    return record
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+def typed_column(values):
+    """Turn a column's values into an array with one explicit dtype.
+
+    Integers become int64, or float64 when the column has gaps, and mixed
+    integers and floats become float64. Booleans without gaps stay bool.
+    Everything else, including booleans with gaps, is kept as objects with NaN
+    in the gaps; integers among them are floats too when the column has gaps,
+    so an ID is written as 1000.0 in every column with missing values, as in
+    the existing shards.
+    """
+    present = {type(value) for value in values if not is_missing(value)}
+    has_gaps = any(is_missing(value) for value in values)
+    if present == {bool} and not has_gaps:
+        return np.array(values, dtype=bool)
+    if present == {int} and not has_gaps:
+        return np.array(values, dtype='int64')
+    if present and present <= {int, float}:
+        return np.array([np.nan if is_missing(value) else value for value in values], dtype='float64')
+    column = np.empty(len(values), dtype=object)
+    # Assigned one by one so list values such as galaxy Clusters stay as single cells
+    for position, value in enumerate(values):
+        if is_missing(value):
+            value = np.nan
+        elif has_gaps and type(value) is int:
+            value = float(value)
+        column[position] = value
+    return column
+
+def event_records(event):
+    """Yield the flattened rows of one event: the event row followed by its nested items."""
+    event_data = event['Event']
+
+    # Rename the 'id' column to 'event_id' in place and drop the nested lists from the event row
+    event_record = {('event_id' if key == 'id' else key): value for key, value in flatten_record(event_data).items() if key not in NESTED_KEYS}
+    yield event_record
+
+    event_id = event_record['event_id']
+    for key in NESTED_KEYS:
+        for item in event_data.get(key, []):
+            record = flatten_record(item)
+            record['event_id'] = event_id  # Associate with the main event ID
+            yield record
+
+def flatten_events(events):
+    """Walk a batch of events once and build a single DataFrame of their rows.
+
+    Values are collected into one plain list per column, padded with None
+    where a row has no value, and each column is typed once with
+    typed_column. Columns come out in order of first appearance, as
+    concatenating the per-event json_normalize frames ordered them. Text
+    columns are cleaned with TextSanitiser.
+    """
+    columns = {}
+    num_rows = 0
+    for event in events:
+        for record in event_records(event):
+            for key, value in record.items():
+                values = columns.setdefault(key, [])
+                # Rows since the column's last value had none for it
+                values.extend([None] * (num_rows - len(values)))
+                values.append(value)
+            num_rows += 1
+    for values in columns.values():
+        values.extend([None] * (num_rows - len(values)))
+    if not columns:
+        return pd.DataFrame()
+    df = pd.DataFrame({key: typed_column(values) for key, values in columns.items()}, index=pd.RangeIndex(num_rows))
+    # Strings are sanitised column by column once the frame is built
+    return clean_text_columns(df)
@@ -0,0 +1,139 @@
+import datetime
+import gzip
+import json
+import os
+import struct
+
+# Index record: event_id, byte offset, byte length, event timestamp, largest event_id stored so far
+INDEX_RECORD = struct.Struct('<QQIQQ')
+
+def json_serial(obj):
+    """JSON serializer for objects not serializable by default json code"""
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()  # Convert datetime/date to ISO8601 string
+    raise TypeError("Type not serializable")
+
+def index_path_for(store_path):
+    """Return the path of the sidecar offset index for a store."""
+    return store_path + '.idx'
+
+def is_compressed(store_path):
+    """Stores ending in .gz keep every event as its own gzip member so it can be read on its own."""
+    return store_path.endswith('.gz')
+
+def event_timestamp(event):
+    """Return the event timestamp as epoch seconds, or 0 if it is unknown."""
+    value = event['Event'].get('timestamp')
+    if value in (None, ''):
+        return 0
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    if isinstance(value, str) and not value.isdigit():
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+def read_index_records(store_path):
+    """Yield (event_id, offset, length, timestamp, max_event_id) for every event in the store."""
+    index_path = index_path_for(store_path)
+    if not os.path.exists(index_path):
+        return
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    yield from INDEX_RECORD.iter_unpack(data[:usable])
+
+def load_index(store_path):
+    """Load the index as event_id -> (offset, length, timestamp); later records supersede earlier ones."""
+    return {record[0]: record[1:4] for record in read_index_records(store_path)}
+
+def read_last_index_record(store_path):
+    """Read only the final index record, or None if the store is empty."""
+    index_path = index_path_for(store_path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        size -= size % INDEX_RECORD.size
+        if size == 0:
+            return None
+        f.seek(size - INDEX_RECORD.size)
+        return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+
+def get_latest_event_id(store_path):
+    """Return the largest event ID in the store in O(1) by reading the last index record."""
+    record = read_last_index_record(store_path)
+    return record[4] if record else 0
+
+def encode_event(event, compressed):
+    line = (json.dumps(event, default=json_serial) + '\n').encode('utf-8')
+    return gzip.compress(line) if compressed else line
+
+def decode_event(data, compressed):
+    if compressed:
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+def append_events(store_path, events):
+    """Append events to the store and index them; only the new events are written."""
+    compressed = is_compressed(store_path)
+    last_record = read_last_index_record(store_path)
+    indexed_end = last_record[1] + last_record[2] if last_record else 0
+    max_event_id = last_record[4] if last_record else 0
+
+    records = []
+    with open(store_path, 'ab') as store:
+        # Discard bytes left behind by an interrupted run that never made it into the index
+        if store.tell() != indexed_end:
+            store.truncate(indexed_end)
+            store.seek(indexed_end)
+        for event in events:
+            data = encode_event(event, compressed)
+            event_id = int(event['Event']['id'])
+            max_event_id = max(max_event_id, event_id)
+            records.append(INDEX_RECORD.pack(event_id, store.tell(), len(data), event_timestamp(event), max_event_id))
+            store.write(data)
+        store.flush()
+        os.fsync(store.fileno())
+
+    # The index is only extended once the event data is safely on disk
+    with open(index_path_for(store_path), 'ab') as index:
+        index.write(b''.join(records))
+    return len(records)
+
+def read_event(store_path, event_id, index=None):
+    """Read a single event by ID with one seek, or return None if it is not stored."""
+    if index is None:
+        index = load_index(store_path)
+    entry = index.get(int(event_id))
+    if entry is None:
+        return None
+    offset, length, _ = entry
+    with open(store_path, 'rb') as store:
+        store.seek(offset)
+        return decode_event(store.read(length), is_compressed(store_path))
+
+def iter_events(store_path, min_event_id=None):
+    """Stream the current version of every event in storage order without loading the whole store."""
+    if not os.path.exists(store_path):
+        return
+    compressed = is_compressed(store_path)
+    records = list(read_index_records(store_path))
+    current = {record[0]: record[1] for record in records}
+    with open(store_path, 'rb') as store:
+        for event_id, offset, length, _, _ in records:
+            # Skip versions of an event that were superseded by a later append
+            if current[event_id] != offset:
+                continue
+            if min_event_id is not None and event_id <= min_event_id:
+                continue
+            store.seek(offset)
+            yield decode_event(store.read(length), compressed)
+
+def import_json_archive(json_path, store_path):
+    """One-off migration of an existing official.json array into the store."""
+    with open(json_path, 'r') as file:
+        events = json.load(file)
+    events.sort(key=lambda event: int(event['Event']['id']))
+    count = append_events(store_path, events)
+    print(f"Imported {count} events from {json_path} into {store_path}")
+    return count
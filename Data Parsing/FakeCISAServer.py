@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CSV_PATH = '/ICS-CERT_ADV/CISA_ICS_ADV_Master.csv'
+
+def generate_advisories(num_advisories, start_id=1, last_updated='2024-01-01'):
+    """Generate a synthetic CISA_ICS_ADV_Master.csv body with the columns of the real feed."""
+    header = 'icsad_ID,Original_Release_Date,Last_Updated,Year,ICS-CERT_Number,ICS-CERT_Advisory_Title,Vendor,Product,Products_Affected,CVE_Number,Cumulative_CVSS,CVSS_Severity,CWE_Number,Critical_Infrastructure_Sector,Product_Distribution,Company_Headquarters,License\n'
+    rows = [
+        f"{icsad_id},2023-06-{icsad_id % 28 + 1:02d},{last_updated},2023,ICSA-23-{icsad_id:03d}-01,Advisory {icsad_id},Vendor {icsad_id % 40},"
+        f"Product {icsad_id},Product {icsad_id} v1,CVE-2023-{10000 + icsad_id},7.5,High,CWE-79,Energy,Worldwide,United States,CC0\n"
+        for icsad_id in range(start_id, start_id + num_advisories)
+    ]
+    return (header + ''.join(rows)).encode('utf-8')
+
+class FakeCISAHandler(BaseHTTPRequestHandler):
+    """Serves the advisory CSV with ETag and Last-Modified validators and answers conditional requests with 304."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if self.path != CSV_PATH:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body, etag, last_modified = server.body, server.etag, server.last_modified
+        not_modified = False
+        if self.headers.get('If-None-Match') is not None:
+            not_modified = self.headers['If-None-Match'] == etag
+        elif self.headers.get('If-Modified-Since') is not None:
+            not_modified = parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp() >= server.modified_at
+
+        if not_modified:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+
+def set_content(server, body):
+    """Replace the served CSV, updating its validators the way a file host would."""
+    server.body = body
+    server.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    server.modified_at = int(time.time())
+    server.last_modified = formatdate(server.modified_at, usegmt=True)
+
+def start_server(num_advisories=3000, port=0):
+    """Start a fake CISA feed server on localhost in a background thread and return it."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeCISAHandler)
+    server.daemon_threads = True
+    server.request_count = 0
+    server.bytes_sent = 0
+    server.lock = threading.Lock()
+    set_content(server, generate_advisories(num_advisories))
+    server.url = f"http://127.0.0.1:{server.server_address[1]}{CSV_PATH}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    import tempfile
+    from HttpCache import cached_get, save_cache_entry
+
+    # Fetch the feed three times through the cache: first download, unchanged feed, changed feed
+    server = start_server()
+    print(f"Fake CISA server running at {server.url}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for label in ['First fetch', 'Unchanged feed', 'Changed feed']:
+            if label == 'Changed feed':
+                set_content(server, server.body + generate_advisories(5, start_id=3001).split(b'\n', 1)[1])
+            bytes_before = server.bytes_sent
+            body, changed, meta = cached_get(server.url, cache_dir)
+            if meta is not None:
+                save_cache_entry(cache_dir, server.url, meta, body)
+            print(f"{label}: changed={changed}, body {len(body)} bytes, downloaded {server.bytes_sent - bytes_before} bytes")
+    server.shutdown()
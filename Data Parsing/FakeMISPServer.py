@@ -0,0 +1,141 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def generate_event(event_id, attributes_per_event=20, timestamp=None):
+    """Generate a synthetic MISP event in the format returned by /events/view."""
+    rng = random.Random(event_id)
+    if timestamp is None:
+        timestamp = 1700000000 + event_id * 60
+    return {
+        'Event': {
+            'id': str(event_id),
+            'date': time.strftime('%Y-%m-%d', time.gmtime(timestamp)),
+            'info': f"Synthetic event {event_id}",
+            'threat_level_id': str(rng.randint(1, 4)),
+            'published': True,
+            'timestamp': str(timestamp),
+            'publish_timestamp': str(timestamp),
+            'Org': {'id': '1', 'name': 'OT-ISAC'},
+            'Attribute': [
+                {
+                    'id': str(event_id * 1000 + i),
+                    'type': rng.choice(['ip-dst', 'domain', 'sha256', 'md5', 'url']),
+                    'category': 'Network activity',
+                    'value': f"10.{event_id % 256}.{i % 256}.{rng.randint(1, 254)}"
+                }
+                for i in range(attributes_per_event)
+            ],
+            'Tag': [{'id': '1', 'name': 'tlp:amber'}],
+            'Galaxy': [{
+                'id': '1',
+                'name': 'Attack Pattern',
+                'type': 'mitre-attack-pattern',
+                'description': 'ATT&CK Tactic',
+                'GalaxyCluster': [{'id': '7', 'type': 'mitre-attack-pattern', 'value': 'Phishing - T1566', 'description': 'Phishing'}]
+            }]
+        }
+    }
+
+class FakeMISPHandler(BaseHTTPRequestHandler):
+    """Serves synthetic events for /events/view/<id> and /events/restSearch with a configurable latency."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        match = re.fullmatch(r'/events/view/(\d+)', self.path)
+        if not match:
+            self.send_json(404, {'message': 'Not Found'})
+            return
+        time.sleep(server.latency)
+        event_id = int(match.group(1))
+        with server.lock:
+            server.request_count += 1
+        if event_id > server.max_event_id or event_id in server.missing_ids:
+            self.send_json(404, {'name': 'Invalid event', 'message': 'Invalid event', 'url': self.path})
+            return
+        self.send_json(200, server.event(event_id))
+
+    def do_POST(self):
+        server = self.server
+        if self.path != '/events/restSearch':
+            self.send_json(404, {'message': 'Not Found'})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(server.latency)
+        with server.lock:
+            server.request_count += 1
+
+        # Filter on the last-modified or publish timestamp, then page through the matches in ID order
+        field = 'publish_timestamp' if 'publish_timestamp' in query else 'timestamp'
+        since = int(query.get(field, 0))
+        matches = []
+        for event_id in range(1, server.max_event_id + 1):
+            if event_id in server.missing_ids:
+                continue
+            event = server.event(event_id)
+            if int(event['Event'][field]) >= since:
+                matches.append(event)
+        limit = int(query.get('limit', len(matches) or 1))
+        page = int(query.get('page', 1))
+        self.send_json(200, {'response': matches[(page - 1) * limit:page * limit]})
+
+def start_server(max_event_id=1000, missing_ids=(), latency=0.05, attributes_per_event=20, port=0):
+    """Start a fake MISP server on localhost in a background thread and return it."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeMISPHandler)
+    server.daemon_threads = True
+    server.max_event_id = max_event_id
+    server.missing_ids = set(missing_ids)
+    server.latency = latency
+    server.attributes_per_event = attributes_per_event
+    server.request_count = 0
+    # Events listed here report a newer timestamp, as if they were edited after publication
+    server.modified = {}
+    server.event = lambda event_id: generate_event(event_id, server.attributes_per_event, server.modified.get(event_id))
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    import contextlib
+    import io
+    from MISPHarvester import create_session, measure_throughput, sync_events
+
+    # Compare sequential fetching with the concurrent harvester against the local server
+    server = start_server(max_event_id=400, missing_ids=range(100, 105), latency=0.05)
+    print(f"Fake MISP server running at {server.url}")
+    for workers in [1, 4, 16, 32]:
+        session = create_session('fake-key', pool_size=workers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            count, rate = measure_throughput(session, server.url, 1, 500, workers=workers)
+        print(f"Workers: {workers:>2}, Events fetched: {count}, Throughput: {rate:.1f} events/s")
+
+    # Paged restSearch sync: a full backfill, then an incremental run after two events change
+    session = create_session('fake-key', pool_size=1)
+    for page_size in [50, 200]:
+        stats = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            count = sum(1 for _ in sync_events(session, server.url, 0, page_size, stats=stats))
+        print(f"Page size: {page_size:>3}, Events synced: {count}, Requests: {stats['pages']}, Throughput: {stats['events_per_second']:.1f} events/s")
+    server.modified = {10: stats['high_water_mark'] + 60, 250: stats['high_water_mark'] + 120}
+    with contextlib.redirect_stdout(io.StringIO()):
+        changed = [event['Event']['id'] for event in sync_events(session, server.url, stats['high_water_mark'] + 1, 200)]
+    print(f"Incremental sync transferred events: {changed}")
+    server.shutdown()
@@ -1,48 +1,154 @@
 import pandas as pd
 import glob
+import json
 import os
+from ShardManifest import is_enriched, mark_enriched, refresh_manifest, shard_entry
+from Sidecars import is_key_column, other_item_rows
 
-def fill_down_column(dataframe, column_name, initial_value=None):
-    """Fill down values in a specified column until a new value appears."""
-    last_value = initial_value
-    for index, value in dataframe[column_name].items():
-        if pd.isna(value):
-            dataframe.at[index, column_name] = last_value
-        else:
-            last_value = value
-    return dataframe
-
-def load_existing_dataframes(file_pattern='official_part_*.csv'):
-    """Load existing DataFrames from CSV files matching the pattern."""
+# Key of the carry that records whether the next frame starts past its event's attributes
+PAST_ATTRIBUTES = '__past_attributes__'
+
+def fill_within_events(values, events, rows, carry):
+    """Forward-fill values down the given rows of each event; rows before the first event_id start from carry."""
+    filled = values.where(rows, axis=0).groupby(events).ffill()
+    # Rows before the first event_id continue the event carried in from the previous frame or shard
+    continued = ((events == 0) & rows).to_numpy()
+    initial = {column: value for column, value in carry.items() if column in values.columns and value is not None}
+    if continued.any() and initial:
+        filled.loc[continued] = filled.loc[continued].fillna(initial)
+    return filled.where(rows, values, axis=0)
+
+def fill_down_columns(dataframe, columns, carry, attribute_columns=()):
+    """Fill each event's empty cells in the given columns with the values on its first row.
+
+    Rows are grouped by event: an event starts on the row holding its event_id,
+    so values never spill from one event into the next. attribute_columns are
+    filled down the event's attribute rows only, each from the attribute
+    before it, and never into its related event, tag and galaxy rows. carry
+    holds the values of the event the frame starts in the middle of, if any,
+    which fill the frame's rows before its first event_id. Returns the frame
+    and the carry for the next frame: the values of its last event.
+    """
+    event_starts = dataframe['event_id'].notna()
+    events = event_starts.cumsum()
+    # Taken before filling, while the related event, tag and galaxy columns are as written
+    other_items = other_item_rows(dataframe, bool(carry.get(PAST_ATTRIBUTES)))
+    attribute_rows = ~event_starts & ~other_items
+    dataframe[columns] = fill_within_events(dataframe[columns], events, pd.Series(True, index=dataframe.index), carry)
+    # Columns without gaps are left as they are, so their values keep their type
+    gaps = [column for column in attribute_columns if dataframe[column].isna().any()]
+    if gaps:
+        dataframe[gaps] = fill_within_events(dataframe[gaps], events, attribute_rows, carry)
+    if len(dataframe):
+        last_row = dataframe[list(columns) + list(attribute_columns)].iloc[-1]
+        carry = dict(carry)
+        carry.update({column: json_value(value) for column, value in last_row.items()})
+        carry[PAST_ATTRIBUTES] = bool(other_items.iloc[-1])
+    return dataframe, carry
+
+def event_columns(csv_file, excluded_columns, chunksize=100000):
+    """Columns holding event-level fields: those with a value on any event's first row.
+
+    The flattened attribute, tag and galaxy columns are empty on the event's
+    own row, so they are left to be filled down attribute rows only.
+    """
+    found = set()
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize, low_memory=False):
+        event_rows = chunk[chunk['event_id'].notna()]
+        found.update(event_rows.columns[event_rows.notna().any()])
+    return found - set(excluded_columns)
+
+def json_value(value):
+    """Turn a cell value into a plain JSON value, with None for missing cells."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def find_existing_csv_files(file_pattern='official_part_*.csv'):
+    """Find existing CSV files matching the pattern, sorted by part number."""
     csv_files = sorted(
         glob.glob(file_pattern),
         key=lambda x: int(os.path.splitext(x.split('_')[-1])[0]) if x.split('_')[-1].split('.')[0].isdigit() else -1
     )
-    csv_files = [f for f in csv_files if f.split('_')[-1].split('.')[0].isdigit()]
-    dataframes = [pd.read_csv(f, low_memory=False) for f in csv_files]
-    return dataframes, csv_files
-
-# Load existing dataframes
-existing_dfs, existing_csv_files = load_existing_dataframes()
-
-# Initialize the last attribute_timestamp value
-last_timestamp_value = None
-
-# Process each dataframe to update 'attribute_timestamp'
-for i, df in enumerate(existing_dfs):
-    if 'attribute_timestamp' in df.columns:
-        # If this is not the first file and the first data row is empty, fill it with the last timestamp value
-        if last_timestamp_value is not None and pd.isna(df['attribute_timestamp'].iloc[0]):
-            df['attribute_timestamp'].iloc[0] = last_timestamp_value
-        
-        # Fill down the column values
-        df = fill_down_column(df, 'attribute_timestamp', initial_value=last_timestamp_value)
-        
-        # Update the last timestamp value
-        last_timestamp_value = df['attribute_timestamp'].iloc[-1]
-
-        # Save the modified dataframe back to the CSV file
-        df.to_csv(existing_csv_files[i], index=False)
-        print(f"Updated 'attribute_timestamp' in {existing_csv_files[i]}")
-
-print("All CSV files have been updated.")
+    return [f for f in csv_files if f.split('_')[-1].split('.')[0].isdigit()]
+
+def load_fill_state(state_path):
+    """Load the shard name -> {'columns', 'attribute_columns', 'carry_in', 'carry_out'} record of the last fill."""
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r') as file:
+        return json.load(file)
+
+def save_fill_state(fill_state, state_path):
+    with open(state_path + '.tmp', 'w') as file:
+        json.dump(fill_state, file, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+
+def fill_shard(csv_file, columns, attribute_columns, carry, chunksize=100000):
+    """Fill one shard chunk by chunk through a temporary file, so only one chunk is held in memory."""
+    temp_path = csv_file + '.tmp'
+    header = True
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize, low_memory=False):
+        chunk, carry = fill_down_columns(chunk, columns, carry, attribute_columns)
+        chunk.to_csv(temp_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    os.replace(temp_path, csv_file)
+    return carry
+
+def fill_shards(csv_files, manifest, fill_state, directory='.', excluded_columns=('event_id', 'id', 'attribute_id', 'attribute_type', 'attribute_category')):
+    """Forward-fill every sparse column of every shard within each event.
+
+    Event-level columns are filled from the event's first row, the other
+    columns down the event's attribute rows. The key columns and the related
+    event, tag and galaxy columns are never filled. A shard's leading rows are
+    filled from the previous shard only when the shard starts in the middle of
+    an event. A shard is filled again only if it changed since it was last
+    filled, or if the values carried into it from the shards before it are
+    different now.
+    """
+    carry = {}
+    carried_columns = []
+    for csv_file in csv_files:
+        name = os.path.basename(csv_file)
+        state = fill_state.get(name)
+        if state is not None and is_enriched(manifest, csv_file, 'fill_values'):
+            if set(state['columns']) & set(excluded_columns):
+                # The first version of this pass filled every column across events, which cannot be undone
+                # in place; regenerate the shard with regenerate_shards in MISPJson_To_CSV.py
+                print(f"{csv_file} was filled by an older pass that also filled its key columns, regenerate it from the event store")
+                carry, carried_columns = state['carry_out'], []
+                continue
+            if 'attribute_columns' in state and state['carry_in'] == {key: carry.get(key) for key in state['carry_in']}:
+                # Unchanged since it was filled, so its last values are taken from the state without reading it
+                carry, carried_columns = state['carry_out'], state['columns']
+                print(f"Values already filled in {csv_file}")
+                continue
+
+        # A shard holding only the middle of an event has no event rows of its own, so the carried columns count too
+        found = event_columns(csv_file, excluded_columns)
+        shard_columns = shard_entry(manifest, csv_file)['columns']
+        columns = [column for column in shard_columns if column in found or (column in carried_columns and column not in excluded_columns)]
+        attribute_columns = [column for column in shard_columns if column not in columns and column not in excluded_columns and not is_key_column(column)]
+        keys = columns + attribute_columns + [PAST_ATTRIBUTES]
+        carry_in = {key: carry.get(key) for key in keys}
+        carry = fill_shard(csv_file, columns, attribute_columns, carry_in)
+        carry, carried_columns = {key: carry.get(key) for key in keys}, columns
+        mark_enriched(manifest, csv_file, 'fill_values', directory)
+        fill_state[name] = {'columns': columns, 'attribute_columns': attribute_columns, 'carry_in': carry_in, 'carry_out': carry}
+        save_fill_state(fill_state, os.path.join(directory, 'fill_state.json'))
+        print(f"Filled {len(columns)} event columns and {len(attribute_columns)} attribute columns in {csv_file}")
+
+if __name__ == '__main__':
+    directory = '.'
+    # event_id stays sparse so that readfile() can still find where each event starts,
+    # and the key columns are never filled so enrichment results stay on their own rows;
+    # attribute_type and attribute_category are never masked, so they have no gaps to fill
+    excluded_columns = ('event_id', 'id', 'attribute_id', 'attribute_type', 'attribute_category')
+
+    # Find existing shards and bring their manifest up to date
+    existing_csv_files = find_existing_csv_files()
+    manifest = refresh_manifest(existing_csv_files, directory)
+    fill_state = load_fill_state(os.path.join(directory, 'fill_state.json'))
+
+    fill_shards(existing_csv_files, manifest, fill_state, directory, excluded_columns)
+    print("All CSV files have been updated.")
@@ -0,0 +1,103 @@
+import sqlite3
+import time
+from collections import OrderedDict
+
+# Locations of an address rarely move, so they are kept for a month; addresses
+# FindIP had no complete location for are retried after a day
+LOCATION_TTL = 30 * 24 * 3600
+NOT_FOUND_TTL = 24 * 3600
+
+class IPCache:
+    """Persistent {ip: [country, latitude, longitude] or None} cache shared by the FindIP scripts.
+
+    Entries are kept in SQLite so every run and every script reuses them, and
+    the most recently used ones also in memory, up to memory_size addresses.
+    None marks an address FindIP has no complete location for.
+    """
+
+    def __init__(self, cache_path='findip_cache.sqlite', ttl=LOCATION_TTL, not_found_ttl=NOT_FOUND_TTL, memory_size=10000):
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.stats = {'hits': 0, 'negative_hits': 0, 'memory_hits': 0, 'misses': 0, 'expired': 0}
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            "ip TEXT PRIMARY KEY, found INTEGER NOT NULL, country TEXT, latitude REAL, longitude REAL, "
+            "fetched_at INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+
+    def fresh(self, location, fetched_at, now):
+        return now - fetched_at <= (self.ttl if location is not None else self.not_found_ttl)
+
+    def remember(self, ip, location, fetched_at):
+        self.memory[ip] = (location, fetched_at)
+        self.memory.move_to_end(ip)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def count_hit(self, location):
+        self.stats['hits' if location is not None else 'negative_hits'] += 1
+
+    def get_many(self, ips, now=None, with_times=False):
+        """Return {ip: location or None} for every address with a fresh entry.
+
+        Addresses missing from the result have never been looked up or their
+        entry expired, and must be queried. With with_times, each value is a
+        (location, fetched_at) pair instead.
+        """
+        now = int(time.time()) if now is None else now
+        cached = {}
+        on_disk = []
+        for ip in dict.fromkeys(ips):
+            if ip in self.memory:
+                location, fetched_at = self.memory[ip]
+                if self.fresh(location, fetched_at, now):
+                    self.memory.move_to_end(ip)
+                    cached[ip] = (location, fetched_at) if with_times else location
+                    self.count_hit(location)
+                    self.stats['memory_hits'] += 1
+                    continue
+                del self.memory[ip]
+            on_disk.append(ip)
+        # SQLite limits the number of bound parameters, so the lookup is done in batches
+        for start in range(0, len(on_disk), 500):
+            batch = on_disk[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT ip, found, country, latitude, longitude, fetched_at FROM locations WHERE ip IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for ip, found, country, latitude, longitude, fetched_at in rows:
+                location = [country, latitude, longitude] if found else None
+                if not self.fresh(location, fetched_at, now):
+                    self.stats['expired'] += 1
+                    continue
+                self.remember(ip, location, fetched_at)
+                cached[ip] = (location, fetched_at) if with_times else location
+                self.count_hit(location)
+        self.stats['misses'] += sum(1 for ip in on_disk if ip not in cached)
+        return cached
+
+    def put(self, ip, location, now=None):
+        """Cache a lookup result; location is [country, latitude, longitude], or None if it was incomplete."""
+        now = int(time.time()) if now is None else now
+        country, latitude, longitude = location if location is not None else (None, None, None)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?)",
+            (ip, int(location is not None), country, latitude, longitude, now)
+        )
+        # Committed straight away so a lookup against the quota is never lost to a crash
+        self.connection.commit()
+        self.remember(ip, location, now)
+
+    def print_stats(self, label='FindIP cache'):
+        looked_up = self.stats['hits'] + self.stats['negative_hits'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] + self.stats['negative_hits']) / looked_up * 100 if looked_up else 0.0
+        print(f"{label}: {looked_up} IP lookups, {self.stats['hits']} hits, {self.stats['negative_hits']} negative hits "
+              f"({self.stats['memory_hits']} from memory), {self.stats['misses']} misses ({self.stats['expired']} expired), "
+              f"hit rate {hit_rate:.1f}%")
+
+    def close(self):
+        self.connection.close()
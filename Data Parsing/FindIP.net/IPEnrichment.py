@@ -0,0 +1,132 @@
+import os
+import re
+import sys
+import time
+import pandas as pd
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Journal import Journal
+from Sidecars import join_sidecars, row_keys, write_sidecar
+
+IP_COLUMNS = ['Country Name', 'Latitude', 'Longitude']
+
+def extract_ip_addresses(text):
+    """Extracts IP addresses from given text using a regex."""
+    ip_pattern = r'\b(?:\d{1,3}\.){3}\d{1,3}\b'
+    return re.findall(ip_pattern, text)
+
+def fetch_ip_info(ip_address, api_key):
+    """Fetches IP information from the API."""
+    url = f'https://api.findip.net/{ip_address}/?token={api_key}'
+    try:
+        response = requests.get(url)
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        print(f"Error querying API for {ip_address}: {str(e)}")
+        return None
+
+def ip_location(ip_info):
+    """Return [country, latitude, longitude] from an API response, or None if any of them is missing."""
+    country = ip_info.get('country', {}).get('names', {}).get('en')
+    latitude = ip_info.get('location', {}).get('latitude')
+    longitude = ip_info.get('location', {}).get('longitude')
+    if country and latitude and longitude:
+        return [country, latitude, longitude]
+    return None
+
+def pending_ips(data):
+    """Return the IP addresses of each row still missing its location, keyed by row index."""
+    pending = data.reindex(columns=IP_COLUMNS).isna().any(axis=1) & data['attribute_value'].notna()
+    ip_lists = data.loc[pending, 'attribute_value'].astype(str).map(extract_ip_addresses)
+    return ip_lists[ip_lists.map(len) > 0]
+
+def read_with_locations(filepath):
+    """Read a CSV with the locations found so far, which are kept in its FindIP sidecar."""
+    return join_sidecars(pd.read_csv(filepath, low_memory=False), filepath, ['findip'])
+
+def fold_locations(filepath, locations):
+    """Write the locations of a CSV's pending rows from {ip: location} to its sidecar.
+
+    Like the row-by-row lookups this replaces, the last IP of a row with a
+    complete location wins.
+    """
+    data = read_with_locations(filepath)
+    rows = {}
+    for index, ip_list in pending_ips(data).items():
+        found = [locations[ip] for ip in ip_list if locations.get(ip) is not None]
+        if found:
+            rows[index] = found[-1]
+    if rows:
+        values = pd.DataFrame.from_dict(rows, orient='index', columns=IP_COLUMNS)
+        write_sidecar(filepath, 'findip', row_keys(data, filepath).loc[values.index], values)
+    print(f"Saved locations into {len(rows)} rows of {filepath}")
+    return len(rows)
+
+def apply_journal_entries(entries):
+    """Fold journalled lookups into their files, rewriting each file once."""
+    by_file = {}
+    for entry in entries:
+        by_file.setdefault(entry['file'], {})[entry['ip']] = entry['location']
+    for filepath, locations in by_file.items():
+        fold_locations(filepath, locations)
+
+def open_journal(directory, cache, compact_every=1000):
+    """Open the FindIP journal and fold in whatever a previous run left behind.
+
+    The results it held are also put in the cache, so a restart never queries
+    those IPs again. They keep the time they were looked up, so replaying them
+    does not extend how long they are cached.
+    """
+    journal = Journal(os.path.join(directory, 'findip_journal.ndjson'), apply_journal_entries, compact_every)
+    entries = journal.replay()
+    for entry in entries:
+        # Entries journalled before lookup times were recorded were put in the cache when they were looked up
+        if 'fetched_at' in entry:
+            cache.put(entry['ip'], entry['location'], now=entry['fetched_at'])
+    if entries:
+        print(f"Replaying {len(entries)} journal entries from a previous run")
+        journal.compact()
+    return journal
+
+def lookup_file_ips(filepath, api_key, journal, cache, max_queries=None):
+    """Look up the IPs of a file's pending rows, journalling each result as it arrives.
+
+    Each distinct IP is looked up once, in the IP cache or else against the API,
+    and its location fills every row it appears in. Cached IPs are journalled
+    for this file without another query. The rows themselves are written by
+    the journal's compaction. Returns the number of API queries made.
+    """
+    data = read_with_locations(filepath)
+    print(f"Processing file: {filepath}")
+    ip_lists = pending_ips(data)
+    ips = list(dict.fromkeys(ip for ip_list in ip_lists for ip in ip_list))
+    known = cache.get_many(ips, with_times=True)
+    print(f"{len(ip_lists)} rows with IP addresses: {len(ips)} distinct IPs, {len(known)} found in the cache")
+    journal.append_many([
+        {'file': filepath, 'ip': ip, 'location': location, 'fetched_at': fetched_at}
+        for ip, (location, fetched_at) in known.items()
+    ])
+
+    query_count = 0
+    for ip in ips:
+        if ip in known:
+            continue
+        if max_queries is not None and query_count >= max_queries:
+            print(f"Reached maximum query limit of {max_queries}. Stopping process.")
+            break
+        ip_info = fetch_ip_info(ip, api_key)
+        query_count += 1
+        # Failed requests are not cached, so the IP is tried again next run
+        if ip_info is None:
+            continue
+        location = ip_location(ip_info)
+        if location is None:
+            print(f"Warning: Incomplete data for IP {ip}.")
+        else:
+            print(f"Found Country Name: {location[0]}, Latitude: {location[1]}, Longitude: {location[2]} for IP {ip}")
+        fetched_at = int(time.time())
+        cache.put(ip, location, now=fetched_at)
+        journal.append({'file': filepath, 'ip': ip, 'location': location, 'fetched_at': fetched_at})
+    return query_count
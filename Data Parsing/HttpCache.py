@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+import requests
+
+def cache_paths(cache_dir, url):
+    """Metadata and body file of a cached URL, named after a hash of the URL."""
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, key + '.json'), os.path.join(cache_dir, key + '.gz')
+
+def load_cache_entry(cache_dir, url):
+    """Return the cached metadata and body of a URL, or (None, None) if it is not cached."""
+    meta_path, body_path = cache_paths(cache_dir, url)
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None, None
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    with gzip.open(body_path, 'rb') as file:
+        body = file.read()
+    return meta, body
+
+def save_cache_entry(cache_dir, url, meta, body):
+    """Store the body gzip-compressed, then its metadata, each replaced atomically."""
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path, body_path = cache_paths(cache_dir, url)
+    with gzip.open(body_path + '.tmp', 'wb') as file:
+        file.write(body)
+    os.replace(body_path + '.tmp', body_path)
+    with open(meta_path + '.tmp', 'w') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def cached_get(url, cache_dir='http_cache', session=None, timeout=60):
+    """GET a URL through the on-disk cache using its ETag and Last-Modified validators.
+
+    Returns (body, changed, meta). When the server answers 304 Not Modified the
+    cached body is returned without being downloaded again and meta is None.
+    changed is False when the body is identical to the cached one, whether the
+    server said so or not. A downloaded body is not cached here: once it has
+    been processed, save it with save_cache_entry(cache_dir, url, meta, body),
+    so a failure in between leaves it changed for the next run.
+    """
+    meta, cached_body = load_cache_entry(cache_dir, url)
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = (session or requests).get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and meta is not None:
+        print(f"{url} not modified, using the cached copy")
+        return cached_body, False, None
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch {url}. HTTP Status: {response.status_code}")
+
+    body = response.content
+    sha256 = hashlib.sha256(body).hexdigest()
+    changed = meta is None or meta.get('sha256') != sha256
+    return body, changed, {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': sha256,
+        'fetched_at': int(time.time())
+    }
@@ -1,20 +1,25 @@
 import pandas as pd
-import requests
 import io
 import os
+from HttpCache import cached_get, save_cache_entry
+from KeyedCsv import merge_sorted
 #from google.colab import files
 
 # Mount Google Drive
 #drive.mount('/content/drive')
 
 
-def fetch_cisa_data(url):
-    """Fetches the CSV data from the provided GitHub URL."""
-    response = requests.get(url)
-    if response.status_code == 200:
-        return pd.read_csv(io.StringIO(response.text))
-    else:
-        raise Exception(f"Failed to fetch CSV. HTTP Status: {response.status_code}")
+def fetch_cisa_data(url, cache_dir='http_cache'):
+    """Fetches the CSV data from the provided GitHub URL through the local HTTP cache.
+
+    Returns the data, whether it changed since the last merged fetch, and a
+    function that records this fetch in the cache once it has been merged.
+    """
+    body, changed, meta = cached_get(url, cache_dir)
+    def commit():
+        if meta is not None:
+            save_cache_entry(cache_dir, url, meta, body)
+    return pd.read_csv(io.BytesIO(body)), changed, commit
 
 def get_next_icsad_id(local_data):
     """Returns the next ICSAD_ID to start pulling data from."""
@@ -25,6 +30,14 @@ def get_next_icsad_id(local_data):
 def merge_local_csv_with_cisa_data(local_filepath, cisa_data):
     """Merges local CSV file with data fetched from CISA GitHub CSV."""
     if os.path.exists(local_filepath):
+        # New advisories are appended and advisories with a new Last_Updated are replaced in place
+        stats = merge_sorted(local_filepath, cisa_data, 'icsad_ID', 'Last_Updated')
+        if stats is not None:
+            print(f"Inserted {stats['inserted']} new advisories, updated {stats['updated']}, {stats['unchanged']} unchanged.")
+            print(f"Updated data saved to '{local_filepath}'.")
+            return
+
+        # The feed has columns the local file lacks, so the whole file is rewritten once
         print(f"File {local_filepath} exists. Reading the file...")
         local_data = pd.read_csv(local_filepath, low_memory=False)
         print("Local data read successfully. Here are the first few rows:")
@@ -50,12 +63,19 @@ if __name__ == '__main__':
     cisa_url = 'https://raw.githubusercontent.com/icsadvprj/ICS-Advisory-Project/main/ICS-CERT_ADV/CISA_ICS_ADV_Master.csv'
     #local_csv_path = '/content/drive/MyDrive/CISA.csv'
     local_csv_path = 'CISA2.csv'
+    # ETag/Last-Modified validators and the compressed feed are kept here between runs
+    cache_dir = 'http_cache'
     
     try:
-        cisa_csv_data = fetch_cisa_data(cisa_url)
-        print("CISA data fetched successfully. Here are the first few rows:")
-        print(cisa_csv_data.head())
+        cisa_csv_data, changed, commit = fetch_cisa_data(cisa_url, cache_dir)
+        if not changed and os.path.exists(local_csv_path):
+            print("CISA data has not changed since the last run. Skipping the merge.")
+        else:
+            print("CISA data fetched successfully. Here are the first few rows:")
+            print(cisa_csv_data.head())
 
-        merge_local_csv_with_cisa_data(local_csv_path, cisa_csv_data)
+            merge_local_csv_with_cisa_data(local_csv_path, cisa_csv_data)
+        # The fetch is only cached once merged, so a failed merge is retried on the next run
+        commit()
     except Exception as e:
         print(str(e))
@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+from Upsert import upsert
 
 def load_data(file_path, required_columns, drop_column=None):
     """Loads CSV data from a given file path, ensuring all required columns are present, and optionally dropping a specified column."""
@@ -38,26 +39,15 @@ def append_data(file_path, secondary_file_path, required_columns, drop_column=No
     highest_icsad_id = primary_data['icsad_ID'].max()
     print(f"Highest icsad_ID in {file_path}: {highest_icsad_id}")
 
-    # Merge new rows based on icsad_ID
-    combined_data = primary_data.merge(secondary_data, on='icsad_ID', how='outer', suffixes=('', '_new'))
-
-    # Ensure all required columns are present in the combined data
-    for column in required_columns:
-        if column not in combined_data.columns:
-            combined_data[column] = pd.NA
-
-    # Drop duplicate columns if suffix is applied
-    for column in combined_data.columns:
-        if column.endswith('_new'):
-            original_column = column[:-4]
-            combined_data[original_column] = combined_data[original_column].combine_first(combined_data[column])
-            combined_data.drop(columns=[column], inplace=True)
-
-    # Reorder columns to match the primary data
-    combined_data = combined_data[primary_data.columns]
+    # Insert new advisories and fill empty cells of existing ones, keyed on icsad_ID
+    combined_data, stats = upsert(primary_data, secondary_data, 'icsad_ID')
+    print(f"Inserted rows: {stats['inserted']}, updated rows: {stats['updated']}")
 
     print(f"Combined data shape: {combined_data.shape}")
 
+    if stats['inserted'] == 0 and stats['updated'] == 0:
+        print(f"No new data for {file_path}, leaving it unchanged.")
+        return
     save_data(combined_data, file_path)
     print(f"New rows merged side-by-side in {file_path}.")
 
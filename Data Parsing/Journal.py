@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+
+class Journal:
+    """Append-only NDJSON log of enrichment results, folded into the shards in bulk.
+
+    Every entry is flushed and fsynced before append returns, so an API result
+    is never lost once it has arrived. Once compact_every entries have
+    accumulated, a background thread moves them to a compaction file and hands
+    them to apply, which folds them into the shards; the compaction file is
+    deleted only after apply returns. apply must be idempotent, since entries of
+    an interrupted compaction are applied again after a restart.
+    """
+
+    def __init__(self, path, apply, compact_every=1000):
+        self.path = path
+        self.compacting_path = path + '.compacting'
+        self.apply = apply
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.compactor = None
+        truncate_torn_entry(path)
+        self.file = open(path, 'ab')
+        self.pending = len(read_entries(path))
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending += len(entries)
+            start_compaction = self.pending >= self.compact_every and not self.compacting()
+        if start_compaction:
+            self.compactor = threading.Thread(target=self.compact)
+            self.compactor.start()
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def compacting(self):
+        return self.compactor is not None and self.compactor.is_alive()
+
+    def replay(self):
+        """Return every entry not yet folded into the shards, oldest first."""
+        with self.lock:
+            return read_entries(self.compacting_path) + read_entries(self.path)
+
+    def rotate(self):
+        """Move the journal's entries to the compaction file and start an empty journal."""
+        with self.lock:
+            self.file.close()
+            if os.path.exists(self.compacting_path):
+                # Left over from a compaction that did not finish
+                with open(self.path, 'rb') as source, open(self.compacting_path, 'ab') as target:
+                    target.write(source.read())
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.compacting_path)
+            self.file = open(self.path, 'ab')
+            self.pending = 0
+
+    def compact(self):
+        self.rotate()
+        entries = read_entries(self.compacting_path)
+        if entries:
+            self.apply(entries)
+            print(f"Compacted {len(entries)} journal entries into the shards")
+        os.remove(self.compacting_path)
+
+    def close(self):
+        """Wait for a running compaction, fold whatever is left and remove the journal."""
+        if self.compactor is not None:
+            self.compactor.join()
+        self.compact()
+        with self.lock:
+            self.file.close()
+        os.remove(self.path)
+
+def truncate_torn_entry(path):
+    """Cut off a last entry that a crash left half written, so new entries start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r+b') as file:
+        data = file.read()
+        if data and not data.endswith(b'\n'):
+            file.truncate(data.rfind(b'\n') + 1)
+
+def read_entries(path):
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.endswith(b'\n'):
+                entries.append(json.loads(line))
+    return entries
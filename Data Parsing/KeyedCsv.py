@@ -0,0 +1,222 @@
+import bisect
+import csv
+import io
+import json
+import os
+import pandas as pd
+
+def index_path_for(csv_path):
+    return csv_path + '.idx.json'
+
+def iter_csv_records(file, offset):
+    """Yield (offset, raw bytes) of every CSV record from offset on.
+
+    A record can span lines when a quoted field holds a newline, so lines are
+    joined until the record's quotes are balanced.
+    """
+    file.seek(offset)
+    record = b''
+    start = offset
+    for line in iter(file.readline, b''):
+        record += line
+        if record.count(b'"') % 2 == 0:
+            yield start, record
+            start += len(record)
+            record = b''
+    if record:
+        yield start, record
+
+def parse_record(raw, encoding='utf-8'):
+    return next(csv.reader(io.StringIO(raw.decode(encoding))))
+
+def read_header(csv_path, encoding='utf-8'):
+    """Return the column names and the byte offset where the first data record starts."""
+    with open(csv_path, 'rb') as file:
+        for offset, raw in iter_csv_records(file, 0):
+            return parse_record(raw, encoding), offset + len(raw)
+    return [], 0
+
+def integer_key(value):
+    """The integer a key cell holds, or None if it is empty or not a number."""
+    number = pd.to_numeric(value, errors='coerce')
+    if pd.isna(number) or number in (float('inf'), float('-inf')):
+        return None
+    return int(number)
+
+def build_key_index(csv_path, key, version_column, encoding='utf-8'):
+    """Scan a CSV sorted by key once and record each key's byte range and version.
+
+    Rows whose key is empty or not a number are counted in 'unkeyed' and left
+    out of the entries.
+    """
+    columns, data_offset = read_header(csv_path, encoding)
+    key_position, version_position = columns.index(key), columns.index(version_column)
+    entries = {}
+    unkeyed = 0
+    with open(csv_path, 'rb') as file:
+        for offset, raw in iter_csv_records(file, data_offset):
+            values = parse_record(raw, encoding)
+            row_key = integer_key(values[key_position]) if key_position < len(values) else None
+            if row_key is None:
+                unkeyed += 1
+                continue
+            entries[str(row_key)] = [offset, len(raw), values[version_position] if version_position < len(values) else '']
+    if unkeyed:
+        print(f"{unkeyed} rows of {csv_path} have no numeric {key}")
+    stat = os.stat(csv_path)
+    max_key = max((int(entry_key) for entry_key in entries), default=None)
+    return {'key': key, 'version_column': version_column, 'columns': columns, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'max_key': max_key, 'entries': entries, 'unkeyed': unkeyed}
+
+def load_key_index(csv_path, key, version_column, encoding='utf-8'):
+    """Load the persisted key index, rebuilding it if the CSV was changed by anything else.
+
+    An append that was interrupted is cut off first, back to where it started,
+    so the file matches the index again.
+    """
+    index_path = index_path_for(csv_path)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            key_index = json.load(file)
+        if key_index.get('append_start') is not None:
+            with open(csv_path, 'r+b') as file:
+                file.truncate(key_index['append_start'])
+            print(f"Removed an interrupted append from {csv_path}")
+            stat = os.stat(csv_path)
+            key_index['size'], key_index['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+            del key_index['append_start']
+            save_key_index(csv_path, key_index)
+        stat = os.stat(csv_path)
+        if (key_index['key'], key_index['version_column'], key_index['size'], key_index['mtime_ns']) == (key, version_column, stat.st_size, stat.st_mtime_ns):
+            return key_index
+    print(f"Building key index for {csv_path}")
+    key_index = build_key_index(csv_path, key, version_column, encoding)
+    save_key_index(csv_path, key_index)
+    return key_index
+
+def save_key_index(csv_path, key_index):
+    index_path = index_path_for(csv_path)
+    with open(index_path + '.tmp', 'w') as file:
+        json.dump(key_index, file)
+    os.replace(index_path + '.tmp', index_path)
+
+def version_value(value):
+    """Versions are compared as the text stored in the CSV, where a missing value is empty."""
+    return '' if pd.isna(value) else str(value)
+
+def format_rows(rows, columns, encoding='utf-8'):
+    """Serialise rows the way DataFrame.to_csv writes them and return each row's raw bytes."""
+    data = rows.reindex(columns=columns).to_csv(header=False, index=False).encode(encoding)
+    return [raw for _, raw in iter_csv_records(io.BytesIO(data), 0)]
+
+def merge_sorted(csv_path, new_data, key, version_column, encoding='utf-8'):
+    """Merge rows into a CSV kept sorted by an integer key without rewriting untouched data.
+
+    Rows with unknown keys are inserted in key order and rows whose version
+    column differs replace the stored row. New keys above the current maximum
+    are a pure append. Otherwise the file is replaced by a copy in which
+    everything before the first affected row, and every untouched row after
+    it, is copied byte for byte without being parsed. Rows of the new data
+    without a numeric key are skipped. Returns counts of inserted, updated
+    and unchanged rows, or None if the file must be rewritten whole: when the
+    new data has columns the file lacks, or when the file has rows without a
+    numeric key, which only a full sort can place.
+    """
+    key_index = load_key_index(csv_path, key, version_column, encoding)
+    columns = key_index['columns']
+    if not set(new_data.columns) <= set(columns):
+        return None
+    if key_index.get('unkeyed'):
+        print(f"{csv_path} has rows without a numeric {key}, so it is rewritten whole")
+        return None
+
+    keys = pd.to_numeric(new_data[key], errors='coerce')
+    if keys.isna().any():
+        print(f"Skipped {int(keys.isna().sum())} new rows without a numeric {key}")
+    new_data = new_data[keys.notna()]
+    # Keys read as text are written back as the integers they hold
+    if new_data[key].dtype == object:
+        new_data = new_data.assign(**{key: keys[keys.notna()].astype('int64')})
+    new_data = new_data.drop_duplicates(subset=key, keep='last').sort_values(by=key)
+    entries = key_index['entries']
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    pending_keys = []
+    for row_key, version in zip(new_data[key].astype(int), new_data[version_column]):
+        entry = entries.get(str(row_key))
+        if entry is None:
+            stats['inserted'] += 1
+        elif version_value(version) != entry[2]:
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+            continue
+        pending_keys.append(row_key)
+    if not pending_keys:
+        return stats
+    pending_rows = new_data[new_data[key].astype(int).isin(pending_keys)]
+    pending = {
+        row_key: (raw, version_value(version))
+        for row_key, version, raw in zip(pending_rows[key].astype(int), pending_rows[version_column], format_rows(pending_rows, columns, encoding))
+    }
+
+    # The rewrite starts at the first updated row or at the slot of the first inserted key;
+    # keys above the persisted maximum only need an append
+    first_key = min(pending)
+    if key_index['max_key'] is None or first_key > key_index['max_key']:
+        sorted_keys, position = [], 0
+        start = os.path.getsize(csv_path)
+    else:
+        sorted_keys = sorted(int(entry_key) for entry_key in entries)
+        position = bisect.bisect_left(sorted_keys, first_key)
+        start = entries[str(sorted_keys[position])][0]
+
+    tail_keys = sorted(set(sorted_keys[position:]) | set(pending))
+    rows = []
+    offset = start
+    for tail_key in tail_keys:
+        if tail_key in pending:
+            raw, version = pending[tail_key]
+        else:
+            raw, version = None, entries[str(tail_key)][2]
+        rows.append((tail_key, raw, version))
+
+    if not sorted_keys:
+        # Only new keys above the maximum: appended in place, with the append's start recorded
+        # in the index first so an interrupted append is cut off on the next load
+        key_index['append_start'] = start
+        save_key_index(csv_path, key_index)
+        with open(csv_path, 'ab') as file:
+            for _, raw, _ in rows:
+                file.write(raw)
+            file.flush()
+            os.fsync(file.fileno())
+    else:
+        # The new tail is written to a copy that replaces the file, so a crash leaves the old file whole
+        with open(csv_path, 'rb') as source, open(csv_path + '.tmp', 'wb') as target:
+            remaining = start
+            while remaining:
+                chunk = source.read(min(remaining, 1 << 20))
+                target.write(chunk)
+                remaining -= len(chunk)
+            # Untouched rows after the first change are copied as they are
+            for index, (tail_key, raw, version) in enumerate(rows):
+                if raw is None:
+                    entry_offset, length, _ = entries[str(tail_key)]
+                    source.seek(entry_offset)
+                    raw = source.read(length)
+                    rows[index] = (tail_key, raw, version)
+                target.write(raw)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(csv_path + '.tmp', csv_path)
+
+    # The index is only saved once the data it points into is safely on disk
+    for tail_key, raw, version in rows:
+        entries[str(tail_key)] = [offset, len(raw), version]
+        offset += len(raw)
+    stat = os.stat(csv_path)
+    key_index['size'], key_index['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+    key_index['max_key'] = max(tail_keys[-1], key_index['max_key'] if key_index['max_key'] is not None else tail_keys[-1])
+    key_index.pop('append_start', None)
+    save_key_index(csv_path, key_index)
+    stats['rewritten_bytes'] = offset - start
+    return stats
@@ -0,0 +1,218 @@
+import datetime
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class EventMissing(Exception):
+    """Raised when MISP reports that an event ID does not exist or is not accessible."""
+
+def create_session(misp_key, misp_verifycert=True, pool_size=8):
+    """Create a requests session with a connection pool shared by all harvester workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Authorization': misp_key,
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    })
+    session.verify = misp_verifycert
+    return session
+
+def timestamp_to_iso(value):
+    """Convert a MISP epoch timestamp to the ISO8601 string PyMISP would have produced."""
+    if value in (None, ''):
+        return None
+    return datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc).isoformat()
+
+def build_event_data(event):
+    """Build the trimmed event dictionary stored in official.json from a raw MISP event."""
+    org = event.get('Org') or {}
+    event_data = {
+        'Event': {
+            'id': int(event['id']),
+            'date': event.get('date'),
+            'Org': {
+                'id': org.get('id'),
+                'name': org.get('name'),
+            },
+            'info': event.get('info'),
+            'threat_level_id': int(event['threat_level_id']) if event.get('threat_level_id') else None,
+            'publish_timestamp': timestamp_to_iso(event.get('publish_timestamp')),
+            'timestamp': timestamp_to_iso(event.get('timestamp')),
+            'Attributes': [],
+            'Tags': [],
+            'Galaxies': []
+        }
+    }
+
+    # Append attributes if available
+    for attribute in event.get('Attribute', []):
+        event_data['Event']['Attributes'].append({
+            'id': int(attribute['id']),
+            'type': attribute.get('type'),
+            'category': attribute.get('category'),
+            'value': attribute.get('value')
+        })
+
+    # Append tags if available
+    for tag in event.get('Tag', []):
+        event_data['Event']['Tags'].append({
+            'id': tag.get('id'),
+            'name': tag.get('name'),
+        })
+
+    # Append galaxies if available
+    for galaxy in event.get('Galaxy', []):
+        galaxy_data = {
+            'id': galaxy.get('id'),
+            'name': galaxy.get('name'),
+            'type': galaxy.get('type'),
+            'description': galaxy.get('description'),
+            'Clusters': []
+        }
+        for cluster in galaxy.get('GalaxyCluster', []):
+            galaxy_data['Clusters'].append({
+                'id': cluster.get('id'),
+                'type': cluster.get('type'),
+                'value': cluster.get('value'),
+                'description': cluster.get('description')
+            })
+        event_data['Event']['Galaxies'].append(galaxy_data)
+
+    return event_data
+
+def fetch_event(session, misp_url, event_id, timeout=60):
+    """Fetch a single event through the MISP REST API and return it in official.json format."""
+    url = f"{misp_url.rstrip('/')}/events/view/{event_id}"
+    response = session.get(url, timeout=timeout)
+    if response.status_code in (403, 404):
+        raise EventMissing(f"HTTP Status: {response.status_code}")
+    response.raise_for_status()
+    data = response.json()
+    if 'Event' not in data:
+        raise EventMissing(data.get('errors', data.get('message', 'No event in response')))
+    return build_event_data(data['Event'])
+
+def harvest_events(session, misp_url, start_id, num_event_ids_to_attempt, max_missing_events=10, workers=8, max_in_flight=None):
+    """Fetch events concurrently and yield them in ascending ID order.
+
+    At most max_in_flight requests are outstanding at any time. Results are consumed
+    in ID order so the consecutive missing events rule behaves exactly as in the
+    sequential loop, and no further IDs are submitted once it triggers.
+    """
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    end_id = start_id + num_event_ids_to_attempt
+    missing_event_count = 0
+    next_id = start_id
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while next_id < end_id or pending:
+                # Keep the window of in-flight requests full
+                while next_id < end_id and len(pending) < max_in_flight:
+                    pending.append((next_id, executor.submit(fetch_event, session, misp_url, next_id)))
+                    next_id += 1
+
+                event_id, future = pending.popleft()
+                try:
+                    event_data = future.result()
+                except EventMissing as e:
+                    # Increment the missing event count
+                    missing_event_count += 1
+                    print(f"Failed to fetch event ID: {event_id}, Error: {e}")
+                    # Break the loop if the count of consecutive missing events exceeds the threshold
+                    if missing_event_count >= max_missing_events:
+                        print("Consecutive missing event limit reached; stopping fetch.")
+                        break
+                    continue
+                except Exception as e:
+                    print(f"Unexpected error for event ID: {event_id}, Error: {e}")
+                    break
+
+                print(f"Fetched event ID: {event_id}")
+                # Reset missing event count after successful fetch
+                missing_event_count = 0
+                yield event_data
+        finally:
+            # Drop requests that are no longer needed once the harvest has stopped
+            for _, future in pending:
+                future.cancel()
+
+def measure_throughput(session, misp_url, start_id, num_event_ids_to_attempt, max_missing_events=10, workers=8, max_in_flight=None):
+    """Run a harvest and return the number of events fetched and the events per second."""
+    start_time = time.perf_counter()
+    count = sum(1 for _ in harvest_events(session, misp_url, start_id, num_event_ids_to_attempt, max_missing_events, workers, max_in_flight))
+    elapsed = time.perf_counter() - start_time
+    return count, count / elapsed if elapsed else float('inf')
+
+def search_events_page(session, misp_url, page, page_size, since_timestamp, timestamp_field='timestamp', timeout=300):
+    """Fetch one page of events changed since the given timestamp through restSearch."""
+    url = f"{misp_url.rstrip('/')}/events/restSearch"
+    payload = {
+        'returnFormat': 'json',
+        'page': page,
+        'limit': page_size,
+        timestamp_field: int(since_timestamp)
+    }
+    response = session.post(url, json=payload, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    events = data.get('response', []) if isinstance(data, dict) else data
+    return [build_event_data(item['Event']) for item in events], len(response.content)
+
+def sync_events(session, misp_url, since_timestamp=0, page_size=100, timestamp_field='timestamp', stats=None):
+    """Yield every event changed since since_timestamp, one restSearch page at a time.
+
+    Page, event and byte counters and the running throughput are kept in stats.
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'pages': 0, 'events': 0, 'bytes': 0, 'seconds': 0.0, 'events_per_second': 0.0, 'high_water_mark': int(since_timestamp)})
+    start_time = time.perf_counter()
+    page = 1
+    while True:
+        events, num_bytes = search_events_page(session, misp_url, page, page_size, since_timestamp, timestamp_field)
+        stats['pages'] += 1
+        stats['bytes'] += num_bytes
+        for event_data in events:
+            stats['events'] += 1
+            changed_at = event_data['Event'][timestamp_field]
+            if changed_at:
+                changed_at = int(datetime.datetime.fromisoformat(changed_at).timestamp())
+                stats['high_water_mark'] = max(stats['high_water_mark'], changed_at)
+            yield event_data
+        stats['seconds'] = time.perf_counter() - start_time
+        stats['events_per_second'] = stats['events'] / stats['seconds'] if stats['seconds'] else 0.0
+        print(f"Synced page {page}: {len(events)} events, {stats['events']} total, {stats['events_per_second']:.1f} events/s")
+        # A short page means there is nothing left to fetch
+        if len(events) < page_size:
+            break
+        page += 1
+
+def load_sync_state(state_path, timestamp_field='timestamp'):
+    """Return the high-water mark recorded by the last completed sync, or 0."""
+    if not os.path.exists(state_path):
+        return 0
+    with open(state_path, 'r') as file:
+        state = json.load(file)
+    return int(state.get(timestamp_field, 0))
+
+def save_sync_state(state_path, high_water_mark, timestamp_field='timestamp'):
+    """Record the high-water mark once every page of a sync has been stored."""
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as file:
+            state = json.load(file)
+    state[timestamp_field] = int(high_water_mark)
+    with open(state_path + '.tmp', 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(state_path + '.tmp', state_path)
@@ -1,142 +1,177 @@
 import pandas as pd
-import json
-import math
 import os
 import glob
-
-def clean_text(text):
-    """Remove problematic characters and sanitize text for Excel."""
-    if isinstance(text, str):
-        return ''.join(c for c in text if c.isprintable()).replace('\r', '').replace('\n', ' ').replace('\t', ' ')
-    return text
-
-def load_existing_dataframes(file_pattern='./official/official_part_*.csv'):
-    """Load existing DataFrames from CSV files matching the pattern."""
+from EventFlattener import flatten_events
+from EventStore import iter_events, load_index, read_event
+from ShardIndex import add_segments, build_event_index, events_in_shards, find_modified_events, load_event_index, patch_modified_events, save_event_index
+from NormalizedTables import write_normalized_tables
+from ShardManifest import latest_shard_event_id, refresh_manifest, shard_entry, total_rows
+
+def find_existing_csv_files(file_pattern='./official/official_part_*.csv'):
+    """Find existing CSV files matching the pattern, sorted by part number."""
     csv_files = sorted(
         glob.glob(file_pattern),
         key=lambda x: int(os.path.splitext(x.split('_')[-1])[0]) if x.split('_')[-1].split('.')[0].isdigit() else -1
     )
-    csv_files = [f for f in csv_files if f.split('_')[-1].split('.')[0].isdigit()]
-    dataframes = [pd.read_csv(f, low_memory=False) for f in csv_files]
-    return dataframes, csv_files
+    return [f for f in csv_files if f.split('_')[-1].split('.')[0].isdigit()]
 
-def get_latest_event_id_from_latest_file(csv_files):
-    """Get the largest event ID from the latest existing file."""
+def get_latest_event_id_from_latest_file(manifest, csv_files):
+    """Get the largest event ID in the latest existing file from the shard manifest."""
     if not csv_files:
         return -1, ""
-    
-    latest_csv_file = csv_files[-1]
-    df = pd.read_csv(latest_csv_file, low_memory=False)
-    latest_event_id = -1
-    if 'event_id' in df.columns:
-        latest_event_id = pd.to_numeric(df['event_id'], errors='coerce').max()
-    return latest_event_id, latest_csv_file
-
-def append_data_to_existing_files(chunks, csv_files, num_rows_per_file):
-    """Append data to existing CSV files."""
-    file_index = len(csv_files)
+    return latest_shard_event_id(manifest, csv_files), csv_files[-1]
+
+def open_shard_writer(manifest, csv_files, num_rows_per_file):
+    """Return the writer state for appending to the last shard, or to a new one."""
+    writer = {'file_index': len(csv_files), 'path': None, 'rows': num_rows_per_file, 'columns': None, 'num_rows_per_file': num_rows_per_file}
     if csv_files:
-        last_csv_file = csv_files[-1]
-        last_df = pd.read_csv(last_csv_file, low_memory=False)
-        initial_rows = len(last_df)
-        remaining_space = num_rows_per_file - initial_rows
-        
-        if remaining_space > 0 and chunks:
-            chunk = chunks.pop(0)
-            rows_to_append = min(remaining_space, len(chunk))
-            remaining_chunk = chunk.iloc[rows_to_append:]
-            last_df = pd.concat([last_df, chunk.iloc[:rows_to_append]], ignore_index=True)
-            last_df.to_csv(last_csv_file, index=False)
-            print(f"Appended {rows_to_append} rows to {last_csv_file}")
-            print(f"Initial rows in {last_csv_file}: {initial_rows}, Rows after appending: {len(last_df)}")
-            if not remaining_chunk.empty:
-                chunks.insert(0, remaining_chunk)
-                print(f"Exceeding {num_rows_per_file} rows in {last_csv_file}, creating new file for remaining data.")
+        entry = shard_entry(manifest, csv_files[-1])
+        writer['path'] = csv_files[-1]
+        writer['rows'] = entry['rows']
+        writer['columns'] = list(entry['columns'])
+        print(f"Initial rows in {writer['path']}: {writer['rows']}")
+    return writer
+
+def write_rows_to_shards(writer, df, row_event_ids, event_index, timestamps):
+    """Append a batch of rows to the current shard, starting new shards whenever one is full."""
+    start = 0
+    while start < len(df):
+        if writer['rows'] >= writer['num_rows_per_file']:
+            writer['file_index'] += 1
+            writer['path'] = f"./official/official_part_{writer['file_index']}.csv"
+            writer['rows'] = 0
+            writer['columns'] = None
+
+        rows_to_append = min(writer['num_rows_per_file'] - writer['rows'], len(df) - start)
+        part = df.iloc[start:start + rows_to_append]
+        if writer['columns'] is None:
+            part.to_csv(writer['path'], index=False)
+            writer['columns'] = list(part.columns)
+            print(f"Data saved to {writer['path']}")
+        elif set(part.columns) <= set(writer['columns']):
+            part.reindex(columns=writer['columns']).to_csv(writer['path'], mode='a', header=False, index=False)
+            print(f"Appended {rows_to_append} rows to {writer['path']}")
         else:
-            print(f"No space left in {last_csv_file}. Creating new file for remaining data.")
-                
-    for chunk in chunks:
-        file_index += 1
-        csv_file_path = f'./official/official_part_{file_index}.csv'
-        chunk.to_csv(csv_file_path, index=False)
-        print(f"Data saved to {csv_file_path}")
-
-def expand_nested_fields(df_event, event_data, key):
-    """Expand nested fields like 'Attributes' into separate rows."""
-    expanded_rows = []
-    if key in event_data:
-        for item in event_data[key]:
-            df_temp = pd.json_normalize(item)
-            df_temp = df_temp.applymap(clean_text)
-            df_temp['event_id'] = df_event['event_id'].iloc[0]  # Associate with the main event ID
-            expanded_rows.append(df_temp)
-    if expanded_rows:
-        return pd.concat(expanded_rows, ignore_index=True)
-    return pd.DataFrame()
-
-# Load JSON data
-with open('official.json', 'r', encoding='utf-8') as file:
-    data = json.load(file)
-
-# Load existing dataframes if any
-existing_dfs, existing_csv_files = load_existing_dataframes()
-latest_event_id, latest_event_file = get_latest_event_id_from_latest_file(existing_csv_files)
-
-# If existing data is present, filter out older events
-if latest_event_id != -1:
-    data = [event for event in data if int(event['Event']['id']) > latest_event_id]
-    print(f"Latest event_id found: {latest_event_id} in file: {latest_event_file}")
-    print(f"Processing new events after filtering: {len(data)}")
-
-all_events_df = []  # Store each event's DataFrame
-for event in data:
-    event_data = event['Event']
-    
-    # Normalize the main event data and rename the 'id' column to 'event_id'
-    df_event = pd.json_normalize(event_data)
-    df_event = df_event.applymap(clean_text)
-    if 'id' in df_event.columns:
-        df_event.rename(columns={'id': 'event_id'}, inplace=True)
-    
-    # Drop unnecessary columns from the main event data
-    unnecessary_columns = ['Attributes', 'RelatedEvents', 'Tags', 'Galaxies', 'Clusters']
-    df_event.drop(columns=[col for col in unnecessary_columns if col in df_event.columns], inplace=True)
-    
-    # Expand nested fields and concatenate them vertically
-    df_combined = df_event
-    for key in ['Attributes', 'RelatedEvents', 'Tags', 'Galaxies', 'Clusters']:
-        df_expanded = expand_nested_fields(df_event, event_data, key)
-        if not df_expanded.empty:
-            df_combined = pd.concat([df_combined, df_expanded], ignore_index=True)
-    
-    # Append event DataFrame to the list
-    all_events_df.append(df_combined)
-
-# Concatenate all event DataFrames into a single DataFrame and reset index
-if all_events_df:
-    final_df = pd.concat(all_events_df, ignore_index=True)
-
-    # Debug: Check if 'event_id' column exists
-    if 'event_id' not in final_df.columns:
-        print(final_df.columns)
-        raise KeyError("'event_id' column is missing in the final DataFrame")
-
-    # Replace subsequent duplicated values with NaN except for 'attribute_type' and 'attribute_category'
-    columns_to_process = [col for col in final_df.columns if col not in ['attribute_type', 'attribute_category']]
-    final_df[columns_to_process] = final_df[columns_to_process].mask(final_df[columns_to_process].eq(final_df[columns_to_process].shift()))
-
-    # Define the maximum number of rows per file
-    average_row_limit = 500000
-
-    if existing_dfs:
-        num_rows_per_file = sum(len(df) for df in existing_dfs) // len(existing_dfs)
+            # New columns appeared, so this one shard is rewritten with the wider header
+            shard_df = pd.concat([pd.read_csv(writer['path'], low_memory=False), part], ignore_index=True)
+            shard_df.to_csv(writer['path'], index=False)
+            writer['columns'] = list(shard_df.columns)
+            print(f"Appended {rows_to_append} rows with new columns to {writer['path']}")
+
+        add_segments(event_index, writer['path'], writer['rows'], row_event_ids.iloc[start:start + rows_to_append], timestamps)
+        writer['rows'] += rows_to_append
+        start += rows_to_append
+
+def iter_batches(events, batch_size):
+    """Group an event stream into lists of at most batch_size events."""
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def mask_repeated_values(df, previous_row=None):
+    """Replace subsequent duplicated values with NaN except for 'attribute_type' and 'attribute_category'.
+
+    previous_row is the unmasked last row of the preceding batch, so masking
+    carries across batch boundaries.
+    """
+    columns_to_process = [col for col in df.columns if col not in ['attribute_type', 'attribute_category']]
+    repeated = df[columns_to_process].eq(df[columns_to_process].shift())
+    if previous_row is not None and len(df):
+        repeated.iloc[0] = df[columns_to_process].iloc[0].eq(previous_row.reindex(columns_to_process)).to_numpy()
+    df[columns_to_process] = df[columns_to_process].mask(repeated)
+    return df
+
+if __name__ == '__main__':
+    store_path = 'official.ndjson.gz'
+    event_index_path = './official/event_index.json'
+    # Number of events flattened and written per batch; bounds the memory used
+    batch_size = 1000
+    # 'sparse' writes the official_part_N.csv shards with repeated values masked,
+    # 'normalized' writes an events table and an attributes table keyed by event_id
+    output_mode = 'sparse'
+    events_path = './official/events.csv'
+    attributes_path = './official/attributes.csv'
+    # Shards whose events are rewritten from the event store, e.g. shards damaged by an older FillingValues.py
+    regenerate_shards = []
+
+    if output_mode == 'normalized':
+        processed_events = write_normalized_tables(iter_events(store_path), events_path, attributes_path, load_index(store_path), batch_size)
+        if processed_events == 0:
+            print("No new events to process.")
     else:
-        num_rows_per_file = average_row_limit
-
-    # Split DataFrame into equally sized chunks
-    chunks = [final_df.iloc[i:i + num_rows_per_file] for i in range(0, len(final_df), num_rows_per_file)]
-
-    # Append or save each chunk to a CSV file
-    append_data_to_existing_files(chunks, existing_csv_files, num_rows_per_file)
-else:
-    print("No new events to process.")
+        # Find existing shards if any
+        existing_csv_files = find_existing_csv_files()
+
+        # Row counts, event IDs and columns come from the manifest, which only re-reads shards changed since the last run
+        manifest = refresh_manifest(existing_csv_files)
+        latest_event_id, latest_event_file = get_latest_event_id_from_latest_file(manifest, existing_csv_files)
+
+        # Load the event_id -> (shard, row range) index, building it from the shards on the first run
+        store_index = load_index(store_path)
+        timestamps = {event_id: entry[2] for event_id, entry in store_index.items()}
+        event_index = load_event_index(event_index_path)
+        if not event_index and existing_csv_files:
+            event_index = build_event_index(existing_csv_files, store_index)
+
+        # Events modified since they were converted are replaced in the shard that holds them
+        modified_event_ids = find_modified_events(store_index, event_index)
+        # Regenerated events go through the same patch as modified ones
+        regenerated_event_ids = [event_id for event_id in events_in_shards(event_index, regenerate_shards) if event_id in store_index]
+        modified_event_ids = sorted(set(modified_event_ids) | set(regenerated_event_ids))
+        if modified_event_ids:
+            print(f"Modified events to patch: {len(modified_event_ids)}")
+            replacements = {
+                event_id: mask_repeated_values(flatten_events([read_event(store_path, event_id, store_index)]))
+                for event_id in modified_event_ids
+            }
+            patch_modified_events(event_index, replacements, timestamps)
+            manifest = refresh_manifest(existing_csv_files)
+
+        # Stream events from the append-only event store
+        data = iter_events(store_path)
+
+        # If existing data is present, filter out events that were already converted
+        if latest_event_id != -1:
+            data = (event for event in data if int(event['Event']['id']) > latest_event_id or int(event['Event']['id']) not in event_index)
+            print(f"Latest event_id found: {latest_event_id} in file: {latest_event_file}")
+
+        # Define the maximum number of rows per file
+        average_row_limit = 500000
+
+        if existing_csv_files:
+            num_rows_per_file = total_rows(manifest, existing_csv_files) // len(existing_csv_files)
+        else:
+            num_rows_per_file = average_row_limit
+
+        # Flatten, mask and write one batch at a time so only one batch is held in memory
+        writer = open_shard_writer(manifest, existing_csv_files, num_rows_per_file)
+        previous_row = None
+        processed_events = 0
+        for batch in iter_batches(data, batch_size):
+            batch_df = flatten_events(batch)
+
+            # Debug: Check if 'event_id' column exists
+            if 'event_id' not in batch_df.columns:
+                print(batch_df.columns)
+                raise KeyError("'event_id' column is missing in the final DataFrame")
+
+            # Keep the event ID of every row and the last unmasked row before repeated values are masked
+            row_event_ids = pd.to_numeric(batch_df['event_id'], errors='coerce')
+            last_row = batch_df.iloc[-1].copy()
+            batch_df = mask_repeated_values(batch_df, previous_row)
+            previous_row = last_row
+
+            write_rows_to_shards(writer, batch_df, row_event_ids, event_index, timestamps)
+            processed_events += len(batch)
+            print(f"Processed {processed_events} events")
+
+        if processed_events == 0:
+            print("No new events to process.")
+
+        save_event_index(event_index, event_index_path)
+        refresh_manifest(find_existing_csv_files())
@@ -1,139 +1,73 @@
-import json
-import datetime
-from pymisp import PyMISP
-
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, datetime.date):
-        return obj.isoformat()  # Convert datetime/date to ISO8601 string
-    raise TypeError("Type not serializable")
+import os
+from EventStore import append_events, event_timestamp, get_latest_event_id, import_json_archive, index_path_for, load_index
+from MISPHarvester import create_session, harvest_events, load_sync_state, save_sync_state, sync_events
 
 # MISP connection details
 misp_url = 'https://misp.otisac.org/'
 misp_key = ''  # Replace with your actual MISP API key
 misp_verifycert = True
 
-# Create a PyMISP object
-misp = PyMISP(misp_url, misp_key, misp_verifycert)
+# Number of concurrent workers sharing the pooled HTTP session
+num_workers = 8
+# Maximum number of requests in flight at any time
+max_in_flight = 16
+
+# Create a pooled HTTP session for the MISP REST API
+session = create_session(misp_key, misp_verifycert, pool_size=num_workers)
+
+# 'search' pulls pages of changed events through restSearch; 'probe' requests sequential event IDs
+sync_mode = 'search'
+# Number of events per restSearch page
+page_size = 100
+# Timestamp used for the high-water mark: 'timestamp' (last modified) or 'publish_timestamp'
+timestamp_field = 'timestamp'
+# File recording the high-water mark of the last completed sync
+sync_state_path = 'sync_state.json'
 
 # Number of event IDs to attempt to fetch per run
 num_event_ids_to_attempt = 1000
-# Counter for consecutive missing events
-missing_event_count = 0
 # Maximum allowed consecutive missing events
 max_missing_events = 10
 
-# Path to the JSON file
-file_path = 'official.json'
-
-# Check if JSON file exists and load its contents
-try:
-    with open(file_path, 'r') as file:
-        existing_events = json.load(file)
-    existing_event_ids = {int(event['Event']['id']) for event in existing_events}
-    latest_event_id = max(existing_event_ids)
-    print(f"Latest event ID found: {latest_event_id}")
-except FileNotFoundError:
-    print("JSON file not found. Creating a new one.")
-    existing_events = []
-    existing_event_ids = set()
-    latest_event_id = 0  # Start from 0 if the file doesn't exist
-except ValueError:
-    print("JSON file is empty or corrupted. Creating a new one.")
-    existing_events = []
-    existing_event_ids = set()
-    latest_event_id = 0  # Start from 0 if the file is corrupted
-
-# List to hold new event data
-new_events = []
-
-# Loop to fetch the next set of event IDs
-for event_id in range(latest_event_id + 1, latest_event_id + 1 + num_event_ids_to_attempt):
-    try:
-        # Fetch the specific event
-        response = misp.get_event(event_id, pythonify=True)
-        
-        # Define event_data here to build a dictionary from the response
-        event_data = {
-            'Event': {
-                'id': response.id,
-                'date': response.date.isoformat(),
-                'Org': {
-                    'id': response.org.id if response.org else None,
-                    'name': response.org.name if response.org else None,
-                },
-                'info': response.info,
-                'threat_level_id': response.threat_level_id,
-                'publish_timestamp': response.publish_timestamp,
-                'timestamp': response.timestamp,
-                'Attributes': [],
-                'Tags': [],
-                'Galaxies': []
-            }
-        }
+# Path to the append-only event store and the legacy JSON archive
+file_path = 'official.ndjson.gz'
+legacy_json_path = 'official.json'
 
-        # Append attributes if available
-        if hasattr(response, 'attributes'):
-            for attribute in response.attributes:
-                event_data['Event']['Attributes'].append({
-                    'id': attribute.id,
-                    'type': attribute.type,
-                    'category': attribute.category,
-                    'value': attribute.value
-                })
+# Migrate the legacy JSON archive into the store on the first run
+if not os.path.exists(index_path_for(file_path)) and os.path.exists(legacy_json_path):
+    import_json_archive(legacy_json_path, file_path)
 
-        # Append tags if available
-        if hasattr(response, 'tags'):
-            for tag in response.tags:
-                event_data['Event']['Tags'].append({
-                    'id': tag.id,
-                    'name': tag.name,
-                })
-
-        # Append galaxies if available
-        if hasattr(response, 'galaxies'):
-            for galaxy in response.galaxies:
-                galaxy_data = {
-                    'id': galaxy.id,
-                    'name': galaxy.name,
-                    'type': galaxy.type,
-                    'description': galaxy.description,
-                    'Clusters': []
-                }
-                if hasattr(galaxy, 'GalaxyCluster'):
-                    for cluster in galaxy.GalaxyCluster:
-                        galaxy_data['Clusters'].append({
-                            'id': cluster.id,
-                            'type': cluster.type,
-                            'value': cluster.value,
-                            'description': cluster.description
-                        })
-                event_data['Event']['Galaxies'].append(galaxy_data)
-
-        new_events.append(event_data)  # Append the event data to the list of new events
-        print(f"Fetched event ID: {event_id}")
-        # Reset missing event count after successful fetch
-        missing_event_count = 0
-
-    except AttributeError as e:
-        # Increment the missing event count
-        missing_event_count += 1
-        print(f"Failed to fetch event ID: {event_id}, Error: {e}")
-        # Break the loop if the count of consecutive missing events exceeds the threshold
-        if missing_event_count >= max_missing_events:
-            print("Consecutive missing event limit reached; stopping fetch.")
-            break
-    except Exception as e:
-        print(f"Unexpected error for event ID: {event_id}, Error: {e}")
-        break
-
-# Merge new events with existing events
-all_events = existing_events + new_events
-
-# Convert all events to JSON and save/print
-json_output = json.dumps(all_events, indent=4, default=json_serial)
-#print(json_output)
-
-# Write to a JSON file
-with open(file_path, 'w') as file:
-    file.write(json_output)
+# Read the latest event ID from the store index without loading any events
+latest_event_id = get_latest_event_id(file_path)
+if latest_event_id:
+    print(f"Latest event ID found: {latest_event_id}")
+else:
+    print("Event store not found. Creating a new one.")
+
+if sync_mode == 'search':
+    # Only transfer events that changed since the last completed sync
+    since_timestamp = load_sync_state(sync_state_path, timestamp_field)
+    print(f"Syncing events with {timestamp_field} >= {since_timestamp}")
+    stored_index = load_index(file_path)
+    sync_stats = {}
+    new_events = []
+    for event in sync_events(session, misp_url, since_timestamp, page_size, timestamp_field, stats=sync_stats):
+        # Events on the high-water mark itself come back again; skip the ones already stored
+        stored = stored_index.get(int(event['Event']['id']))
+        if stored is None or stored[2] != event_timestamp(event):
+            new_events.append(event)
+    print(f"Pages: {sync_stats['pages']}, Events: {sync_stats['events']}, Bytes: {sync_stats['bytes']}, "
+          f"Throughput: {sync_stats['events_per_second']:.1f} events/s")
+else:
+    # Fetch the next set of event IDs concurrently; events are returned in ID order
+    new_events = list(harvest_events(session, misp_url, latest_event_id + 1, num_event_ids_to_attempt,
+                                     max_missing_events=max_missing_events, workers=num_workers,
+                                     max_in_flight=max_in_flight))
+
+# Append only the new events to the store
+appended = append_events(file_path, new_events)
+print(f"Appended {appended} new events to {file_path}")
+
+# Advance the high-water mark only after the events are safely stored
+if sync_mode == 'search':
+    save_sync_state(sync_state_path, sync_stats['high_water_mark'], timestamp_field)
@@ -0,0 +1,113 @@
+import os
+import pandas as pd
+from EventFlattener import NESTED_KEYS, flatten_record
+from EventStore import event_timestamp
+from TextSanitiser import clean_text_columns
+
+# record_type value written for the items of each nested list
+RECORD_TYPES = {'Attributes': 'Attribute', 'RelatedEvents': 'RelatedEvent', 'Tags': 'Tag', 'Galaxies': 'Galaxy', 'Clusters': 'Cluster'}
+
+def normalized_frames(events):
+    """Split a batch of events into an events table and an attributes table.
+
+    The events table has one row per event. The attributes table has one row
+    per attribute, related event, tag, galaxy or cluster, with the event_id it
+    belongs to and its record_type. Nothing is masked, so every row is complete.
+    """
+    event_records = []
+    item_records = []
+    for event in events:
+        event_data = event['Event']
+        record = {('event_id' if key == 'id' else key): value for key, value in flatten_record(event_data).items() if key not in NESTED_KEYS}
+        # The store timestamp lets modified events be found from this table alone
+        record['store_timestamp'] = event_timestamp(event)
+        event_records.append(record)
+        for key in NESTED_KEYS:
+            for item in event_data.get(key, []):
+                item_record = {'event_id': record['event_id'], 'record_type': RECORD_TYPES[key]}
+                item_record.update(flatten_record(item))
+                item_records.append(item_record)
+    return clean_text_columns(pd.DataFrame(event_records)), clean_text_columns(pd.DataFrame(item_records))
+
+def append_table(path, df):
+    """Append rows to a table file, rewriting it once if the rows bring new columns."""
+    if df.empty:
+        return
+    if not os.path.exists(path):
+        df.to_csv(path, index=False)
+        return
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    if set(df.columns) <= set(columns):
+        df.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False)
+    else:
+        pd.concat([pd.read_csv(path, low_memory=False), df], ignore_index=True).to_csv(path, index=False)
+
+def remove_events(path, event_ids, chunksize=100000):
+    """Drop the rows of the given events from a table file, streaming it through a temporary file."""
+    if not os.path.exists(path) or not event_ids:
+        return
+    header = True
+    for chunk in pd.read_csv(path, chunksize=chunksize, low_memory=False):
+        chunk[~chunk['event_id'].isin(event_ids)].to_csv(path + '.tmp', mode='w' if header else 'a', header=header, index=False)
+        header = False
+    os.replace(path + '.tmp', path)
+
+def load_converted_timestamps(events_path):
+    """event_id -> store timestamp of every event already in the events table."""
+    if not os.path.exists(events_path):
+        return {}
+    df = pd.read_csv(events_path, usecols=['event_id', 'store_timestamp'], low_memory=False)
+    return dict(zip(df['event_id'].astype(int), df['store_timestamp'].astype(int)))
+
+def write_normalized_tables(events, events_path, attributes_path, store_index, batch_size=1000):
+    """Convert the stored events into the events and attributes tables.
+
+    Events modified since they were converted have their old rows removed and
+    are written again; events not converted yet are appended. Returns the
+    number of events written.
+    """
+    converted = load_converted_timestamps(events_path)
+    modified_event_ids = {event_id for event_id, timestamp in converted.items() if event_id in store_index and store_index[event_id][2] > timestamp}
+
+    # Attribute rows of events missing from the events table were left by an interrupted run
+    if os.path.exists(attributes_path):
+        attribute_event_ids = set(pd.read_csv(attributes_path, usecols=['event_id'], low_memory=False)['event_id'].astype(int))
+        orphaned_event_ids = attribute_event_ids - set(converted)
+    else:
+        orphaned_event_ids = set()
+
+    if modified_event_ids:
+        print(f"Modified events to rewrite: {len(modified_event_ids)}")
+        remove_events(events_path, modified_event_ids)
+    remove_events(attributes_path, modified_event_ids | orphaned_event_ids)
+
+    processed_events = 0
+    batch = []
+    for event in events:
+        event_id = int(event['Event']['id'])
+        if event_id in converted and event_id not in modified_event_ids:
+            continue
+        batch.append(event)
+        if len(batch) >= batch_size:
+            processed_events += write_batch(batch, events_path, attributes_path)
+            batch = []
+    if batch:
+        processed_events += write_batch(batch, events_path, attributes_path)
+    return processed_events
+
+def write_batch(batch, events_path, attributes_path):
+    events_df, attributes_df = normalized_frames(batch)
+    # Attributes are written first, so an event only counts as converted once its attributes are on disk
+    append_table(attributes_path, attributes_df)
+    append_table(events_path, events_df)
+    print(f"Wrote {len(events_df)} events and {len(attributes_df)} attribute rows")
+    return len(batch)
+
+def read_events_with_attributes(events_path, attributes_path, event_columns=None, attribute_columns=None):
+    """Join the two tables into one row per attribute with the event's fields on every row.
+
+    Event columns come first. Events without any attributes keep a single row.
+    """
+    events = pd.read_csv(events_path, usecols=None if event_columns is None else lambda column: column in event_columns or column == 'event_id', low_memory=False)
+    attributes = pd.read_csv(attributes_path, usecols=None if attribute_columns is None else lambda column: column in attribute_columns or column == 'event_id', low_memory=False)
+    return events.merge(attributes, on='event_id', how='left', suffixes=('', '_attribute'))
@@ -0,0 +1,116 @@
+import json
+import os
+import pandas as pd
+
+def load_event_index(index_path='./official/event_index.json'):
+    """Load the event_id -> {'timestamp', 'segments': [[shard, start, stop], ...]} index."""
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r') as file:
+        return {int(event_id): entry for event_id, entry in json.load(file).items()}
+
+def save_event_index(event_index, index_path='./official/event_index.json'):
+    """Save the event index atomically so an interrupted run never leaves it half written."""
+    with open(index_path + '.tmp', 'w') as file:
+        json.dump({str(event_id): entry for event_id, entry in event_index.items()}, file)
+    os.replace(index_path + '.tmp', index_path)
+
+def contiguous_runs(event_ids):
+    """Return (event_id, start, stop) for every run of identical event IDs in a Series."""
+    event_ids = pd.Series(event_ids).reset_index(drop=True)
+    run_starts = event_ids.ne(event_ids.shift())
+    run_numbers = run_starts.cumsum()
+    positions = pd.Series(range(len(event_ids)))
+    runs = positions.groupby(run_numbers).agg(['first', 'last'])
+    run_ids = event_ids[run_starts.to_numpy()].to_numpy()
+    return [(run_id, int(first), int(last) + 1) for run_id, first, last in zip(run_ids, runs['first'], runs['last'])]
+
+def add_segments(event_index, shard, file_start, event_ids, timestamps):
+    """Record where the rows of each event landed in a shard; event_ids holds one ID per written row."""
+    for event_id, start, stop in contiguous_runs(event_ids):
+        if pd.isna(event_id):
+            continue
+        event_id = int(event_id)
+        entry = event_index.setdefault(event_id, {'timestamp': 0, 'segments': []})
+        entry['timestamp'] = int(timestamps.get(event_id, entry['timestamp']))
+        segments = entry['segments']
+        # Rows appended right after an existing segment of the same event extend it
+        if segments and segments[-1][0] == shard and segments[-1][2] == file_start + start:
+            segments[-1][2] = file_start + stop
+        else:
+            segments.append([shard, file_start + start, file_start + stop])
+
+def build_event_index(csv_files, store_index):
+    """Build the index from existing shards by reading only their event_id column.
+
+    An event split across shards gets one segment in each of them.
+    """
+    event_index = {}
+    timestamps = {event_id: entry[2] for event_id, entry in store_index.items()}
+    last_event_id = float('nan')
+    for csv_file in csv_files:
+        event_ids = pd.read_csv(csv_file, usecols=['event_id'], low_memory=False)['event_id']
+        event_ids = pd.to_numeric(event_ids, errors='coerce').astype('float64')
+        # A shard can start in the middle of the previous shard's last event
+        if len(event_ids) and pd.isna(event_ids.iloc[0]):
+            event_ids.iloc[0] = last_event_id
+        # Repeated event IDs were masked with NaN when the shard was written
+        event_ids = event_ids.ffill()
+        if len(event_ids) and pd.notna(event_ids.iloc[-1]):
+            last_event_id = event_ids.iloc[-1]
+        add_segments(event_index, csv_file, 0, event_ids, timestamps)
+        print(f"Indexed events in {csv_file}")
+    return event_index
+
+def find_modified_events(store_index, event_index):
+    """Return IDs of converted events whose stored timestamp is newer than the converted one."""
+    return sorted(
+        event_id for event_id, entry in event_index.items()
+        if event_id in store_index and store_index[event_id][2] > entry['timestamp']
+    )
+
+def events_in_shards(event_index, shards):
+    """Return IDs of the events with rows in any of the given shards."""
+    names = {os.path.basename(shard) for shard in shards}
+    return sorted(
+        event_id for event_id, entry in event_index.items()
+        if any(os.path.basename(segment[0]) in names for segment in entry['segments'])
+    )
+
+def patch_modified_events(event_index, replacements, timestamps):
+    """Replace the rows of modified events in the shards that hold them.
+
+    replacements maps event_id -> DataFrame of the event's new rows. The new rows
+    take the place of the event's first segment and any further segments (for an
+    event split across two shards) are removed. Each affected shard is read and
+    written once, and the ranges of later events in it are shifted.
+    """
+    patches_by_shard = {}
+    for event_id, rows in replacements.items():
+        for position, segment in enumerate(event_index[event_id]['segments']):
+            patches_by_shard.setdefault(segment[0], []).append((segment, rows if position == 0 else rows.iloc[0:0]))
+
+    segments_by_shard = {}
+    for entry in event_index.values():
+        for segment in entry['segments']:
+            segments_by_shard.setdefault(segment[0], []).append(segment)
+
+    for shard, patches in patches_by_shard.items():
+        df = pd.read_csv(shard, low_memory=False)
+        # Work from the bottom of the shard up so earlier row positions stay valid
+        for segment, rows in sorted(patches, key=lambda patch: patch[0][1], reverse=True):
+            start, stop = segment[1], segment[2]
+            df = pd.concat([df.iloc[:start], rows, df.iloc[stop:]], ignore_index=True)
+            delta = len(rows) - (stop - start)
+            for other in segments_by_shard[shard]:
+                if other[1] >= stop and other is not segment:
+                    other[1] += delta
+                    other[2] += delta
+            segment[2] = start + len(rows)
+        df.to_csv(shard, index=False)
+        print(f"Patched {len(patches)} modified events in {shard}")
+
+    for event_id in replacements:
+        entry = event_index[event_id]
+        entry['segments'] = [segment for segment in entry['segments'] if segment[2] > segment[1]]
+        entry['timestamp'] = int(timestamps[event_id])
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+def manifest_path_for(directory):
+    """The manifest sits next to the shards it describes."""
+    return os.path.join(directory, 'manifest.json')
+
+def load_manifest(directory='./official'):
+    """Load the shard name -> metadata manifest, or an empty one if none was written yet."""
+    manifest_path = manifest_path_for(directory)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def save_manifest(manifest, directory='./official'):
+    """Save the manifest atomically so an interrupted run never leaves it half written.
+
+    Enrichment records are kept in the stage files, not in the manifest.
+    """
+    manifest_path = manifest_path_for(directory)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump({name: {key: value for key, value in entry.items() if key != 'enrichment'} for name, entry in manifest.items()}, file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def stage_path(directory, stage):
+    """Each stage records the shards it finished in enrichment/<stage>.json, which only that stage writes.
+
+    Stages running at the same time therefore never overwrite each other's records.
+    """
+    return os.path.join(directory, 'enrichment', stage + '.json')
+
+def load_stage(directory, stage):
+    """Load a stage's shard name -> checksum record of the shards it finished."""
+    path = stage_path(directory, stage)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def save_stage(done, directory, stage):
+    path = stage_path(directory, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(done, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+def load_enrichment(manifest, directory):
+    """Set every entry's 'enrichment' to the {stage: checksum} records of the stage files."""
+    # Manifests written before the stage files held the records inline; they become the first stage files
+    inline = {}
+    for name, entry in manifest.items():
+        for stage, checksum in entry.get('enrichment', {}).items():
+            inline.setdefault(stage, {})[name] = checksum
+    for stage, done in inline.items():
+        if not os.path.exists(stage_path(directory, stage)):
+            save_stage(done, directory, stage)
+
+    for entry in manifest.values():
+        entry['enrichment'] = {}
+    stages_dir = os.path.join(directory, 'enrichment')
+    for file_name in sorted(os.listdir(stages_dir)) if os.path.isdir(stages_dir) else []:
+        if not file_name.endswith('.json'):
+            continue
+        stage = file_name[:-len('.json')]
+        for name, checksum in load_stage(directory, stage).items():
+            if name in manifest:
+                manifest[name]['enrichment'][stage] = checksum
+
+def file_checksum(path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def describe_shard(csv_file, chunksize=100000):
+    """Collect the metadata of one shard, reading only its event_id and date columns."""
+    columns = list(pd.read_csv(csv_file, nrows=0).columns)
+    usecols = [column for column in ['event_id', 'date'] if column in columns] or [0]
+    rows = 0
+    event_ids = []
+    dates = []
+    for chunk in pd.read_csv(csv_file, usecols=usecols, chunksize=chunksize, low_memory=False):
+        rows += len(chunk)
+        # Repeated values were masked with NaN when the shard was written, so only the non-null ones count
+        if 'event_id' in chunk.columns:
+            event_ids.append(pd.to_numeric(chunk['event_id'], errors='coerce').agg(['min', 'max']))
+        if 'date' in chunk.columns:
+            dates.append(chunk['date'].dropna().astype(str).agg(['min', 'max']))
+    event_ids = pd.concat(event_ids).dropna() if event_ids else pd.Series(dtype=float)
+    dates = pd.concat(dates).dropna() if dates else pd.Series(dtype=object)
+
+    stat = os.stat(csv_file)
+    return {
+        'rows': rows,
+        'min_event_id': int(event_ids.min()) if len(event_ids) else None,
+        'max_event_id': int(event_ids.max()) if len(event_ids) else None,
+        'min_date': dates.min() if len(dates) else None,
+        'max_date': dates.max() if len(dates) else None,
+        'columns': columns,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'checksum': file_checksum(csv_file),
+        'enrichment': {}
+    }
+
+def is_stale(entry, csv_file):
+    """A manifest entry is stale when the file's size or modification time no longer match it."""
+    stat = os.stat(csv_file)
+    return entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns
+
+def update_shard(manifest, csv_file):
+    """Re-describe a shard whose contents changed; its enrichment status is kept but no longer matches."""
+    name = os.path.basename(csv_file)
+    previous = manifest.get(name)
+    entry = describe_shard(csv_file)
+    if previous is not None:
+        entry['enrichment'] = previous.get('enrichment', {})
+    manifest[name] = entry
+    return entry
+
+def refresh_manifest(csv_files, directory='./official'):
+    """Bring the manifest in line with the shards on disk, parsing only shards that changed.
+
+    Entries for shards that no longer exist are dropped. The manifest is saved
+    only if something changed.
+    """
+    manifest = load_manifest(directory)
+    names = {os.path.basename(csv_file) for csv_file in csv_files}
+    changed = False
+    for name in [name for name in manifest if name not in names]:
+        del manifest[name]
+        changed = True
+    for csv_file in csv_files:
+        if is_stale(manifest.get(os.path.basename(csv_file)), csv_file):
+            update_shard(manifest, csv_file)
+            print(f"Updated manifest entry for {csv_file}")
+            changed = True
+    if changed:
+        save_manifest(manifest, directory)
+    load_enrichment(manifest, directory)
+    return manifest
+
+def shard_entry(manifest, csv_file):
+    return manifest[os.path.basename(csv_file)]
+
+def is_enriched(manifest, csv_file, stage):
+    """True if the stage finished on the shard and the shard has not changed since."""
+    entry = manifest.get(os.path.basename(csv_file))
+    return entry is not None and not is_stale(entry, csv_file) and entry['enrichment'].get(stage) == entry['checksum']
+
+def mark_enriched(manifest, csv_file, stage, directory='./official'):
+    """Record that a stage finished on a shard, after the stage has written its results.
+
+    The record holds the shard's checksum, so it lapses when the shard changes.
+    The stage's file is reloaded before it is rewritten, and the manifest is
+    only saved when the stage rewrote the shard itself.
+    """
+    name = os.path.basename(csv_file)
+    entry = manifest.get(name)
+    if is_stale(entry, csv_file):
+        entry = update_shard(manifest, csv_file)
+        save_manifest(manifest, directory)
+    entry['enrichment'][stage] = entry['checksum']
+    done = load_stage(directory, stage)
+    done[name] = entry['checksum']
+    save_stage(done, directory, stage)
+
+def total_rows(manifest, csv_files):
+    return sum(shard_entry(manifest, csv_file)['rows'] for csv_file in csv_files)
+
+def latest_shard_event_id(manifest, csv_files):
+    """Largest event ID in the latest shard, or -1 when there are no shards."""
+    if not csv_files:
+        return -1
+    max_event_id = shard_entry(manifest, csv_files[-1])['max_event_id']
+    return -1 if max_event_id is None else max_event_id
+
+if __name__ == '__main__':
+    import glob
+
+    # Print the catalog of the shards in ./official, refreshing it first
+    csv_files = sorted(glob.glob('./official/official_part_*.csv'), key=lambda x: int(os.path.splitext(x.split('_')[-1])[0]))
+    manifest = refresh_manifest(csv_files)
+    for csv_file in csv_files:
+        entry = shard_entry(manifest, csv_file)
+        stages = ', '.join(stage for stage in entry['enrichment'] if is_enriched(manifest, csv_file, stage)) or 'none'
+        print(f"{csv_file}: {entry['rows']} rows, events {entry['min_event_id']}-{entry['max_event_id']}, "
+              f"dates {entry['min_date']} to {entry['max_date']}, {len(entry['columns'])} columns, enriched: {stages}")
@@ -0,0 +1,142 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+SIDECAR_KEY = ['event_id', 'attribute_id']
+
+# Only related event, tag and galaxy rows have values in these columns
+OTHER_ITEM_COLUMNS = ['name', 'description', 'Clusters']
+
+def is_key_column(column):
+    """Whether row_keys needs the column to tell a shard's rows apart."""
+    return column in ['event_id', 'id'] + OTHER_ITEM_COLUMNS or column.startswith('Event.')
+
+def sidecar_dir(csv_file):
+    return os.path.join(os.path.dirname(csv_file), 'sidecars')
+
+def sidecar_path(csv_file, enricher):
+    """Each enricher keeps its results for a shard in sidecars/<enricher>/<shard name> next to the shard."""
+    return os.path.join(sidecar_dir(csv_file), enricher, os.path.basename(csv_file))
+
+def list_enrichers(csv_file):
+    """Names of the enrichers that have results for a shard."""
+    if not os.path.isdir(sidecar_dir(csv_file)):
+        return []
+    return sorted(enricher for enricher in os.listdir(sidecar_dir(csv_file)) if os.path.exists(sidecar_path(csv_file, enricher)))
+
+def sidecar_signature(csv_file):
+    """Size and modification time of every sidecar of a shard, to tell when its joined view changed."""
+    signature = {}
+    for enricher in list_enrichers(csv_file):
+        stat = os.stat(sidecar_path(csv_file, enricher))
+        signature[enricher] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+def previous_event_id(csv_file):
+    """Last event ID of the shard before csv_file; a shard can start in the middle of that event."""
+    match = re.fullmatch(r'(.*?)(\d+)\.csv', os.path.basename(csv_file))
+    if match is None or int(match.group(2)) <= 1:
+        return np.nan
+    previous = os.path.join(os.path.dirname(csv_file), f"{match.group(1)}{int(match.group(2)) - 1}.csv")
+    if not os.path.exists(previous):
+        return np.nan
+    event_ids = pd.to_numeric(pd.read_csv(previous, usecols=['event_id'], low_memory=False)['event_id'], errors='coerce').dropna()
+    return event_ids.iloc[-1] if len(event_ids) else previous_event_id(previous)
+
+def other_item_rows(df, continued=False):
+    """Whether each row comes after its event's attributes: a related event, tag or galaxy row.
+
+    An event's attributes are written right after its own row, so every row
+    from its first related event, tag or galaxy on is not an attribute, even
+    where masking emptied its columns. continued tells whether the rows before
+    the frame's first event_id are already past their event's attributes.
+    """
+    markers = [column for column in df.columns if is_key_column(column) and column not in ['event_id', 'id']]
+    other_items = df[markers].notna().any(axis=1) if markers else pd.Series(False, index=df.index)
+    events = df['event_id'].notna().cumsum()
+    other_items = other_items | ((events == 0) & continued)
+    return other_items.astype(int).groupby(events).cummax().astype(bool)
+
+def row_keys(df, csv_file):
+    """The (event_id, attribute_id) key of every row of a shard, aligned with its index.
+
+    event_id is only written on an event's first row, so it is forward-filled,
+    continuing from the previous shard. The event's own row gets attribute_id 0
+    and an attribute row its 'id'. Related event, tag and galaxy rows have IDs
+    of their own that can equal an attribute's, so they get no key and are
+    never enriched.
+    """
+    event_starts = pd.to_numeric(df['event_id'], errors='coerce').astype('float64')
+    event_ids = event_starts.copy()
+    if len(event_ids) and pd.isna(event_ids.iloc[0]):
+        event_ids.iloc[0] = previous_event_id(csv_file)
+    ids = pd.to_numeric(df['id'], errors='coerce').astype('float64') if 'id' in df.columns else pd.Series(np.nan, index=df.index)
+    attribute_ids = ids.mask(other_item_rows(df)).mask(event_starts.notna(), 0)
+    return pd.DataFrame({'event_id': event_ids.ffill(), 'attribute_id': attribute_ids}, index=df.index)
+
+def write_sidecar(csv_file, enricher, keys, values):
+    """Append an enricher's results for some rows of a shard to its sidecar.
+
+    keys holds the rows' (event_id, attribute_id) and values their result
+    columns, both aligned. The sidecar is only appended to, so a write costs
+    as much as the new results; when a key is written again the later row wins.
+    Rows without a key are left out.
+    """
+    rows = pd.concat([keys[SIDECAR_KEY], values], axis=1).dropna(subset=SIDECAR_KEY)
+    if rows.empty:
+        return 0
+    path = sidecar_path(csv_file, enricher)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        columns = list(pd.read_csv(path, nrows=0).columns)
+        if set(rows.columns) <= set(columns):
+            rows.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False)
+            return len(rows)
+        # New result columns: the sidecar is small, so it is rewritten with the union of columns
+        rows = pd.concat([pd.read_csv(path, low_memory=False), rows], ignore_index=True)
+    rows.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return len(rows)
+
+def remove_sidecar(csv_file, enricher):
+    """Drop an enricher's results for a shard, e.g. once they are kept elsewhere."""
+    path = sidecar_path(csv_file, enricher)
+    if os.path.exists(path):
+        os.remove(path)
+
+def read_sidecar(csv_file, enricher):
+    path = sidecar_path(csv_file, enricher)
+    if not os.path.exists(path):
+        return None
+    sidecar = pd.read_csv(path, low_memory=False)
+    sidecar[SIDECAR_KEY] = sidecar[SIDECAR_KEY].astype('float64')
+    return sidecar.drop_duplicates(subset=SIDECAR_KEY, keep='last')
+
+def join_sidecars(df, csv_file, enrichers=None):
+    """Add the enrichers' result columns to a shard's rows; sidecar values win over values in the shard."""
+    enrichers = list_enrichers(csv_file) if enrichers is None else enrichers
+    keys = None
+    for enricher in enrichers:
+        sidecar = read_sidecar(csv_file, enricher)
+        if sidecar is None:
+            continue
+        if keys is None:
+            keys = row_keys(df, csv_file)
+        # A left merge keeps the shard's row order and, with unique sidecar keys, its row count
+        joined = keys.merge(sidecar, how='left', on=SIDECAR_KEY)
+        joined.index = df.index
+        for column in sidecar.columns.drop(SIDECAR_KEY):
+            df[column] = joined[column].combine_first(df[column]) if column in df.columns else joined[column]
+    return df
+
+def read_enriched(csv_file, enrichers=None, columns=None):
+    """Read a shard joined with its sidecars, optionally only the given columns."""
+    usecols = None
+    if columns is not None:
+        header = pd.read_csv(csv_file, nrows=0).columns
+        usecols = [column for column in header if column in columns or is_key_column(column)]
+    df = join_sidecars(pd.read_csv(csv_file, usecols=usecols, low_memory=False), csv_file, enrichers)
+    if columns is not None:
+        df = df[[column for column in df.columns if column in columns]]
+    return df
@@ -0,0 +1,219 @@
+import glob
+import json
+import os
+import pandas as pd
+from Sidecars import join_sidecars, sidecar_signature
+
+# pyarrow is only needed for the parquet backend
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+def require_pyarrow():
+    if pq is None:
+        raise ImportError("The parquet storage backend needs pyarrow (pip install pyarrow)")
+
+def write_csv_part(df, path):
+    df.to_csv(path, index=False)
+
+def read_csv_part(path, columns=None):
+    if columns is None:
+        return pd.read_csv(path, low_memory=False)
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, usecols=[column for column in header if column in columns], low_memory=False)
+
+def read_csv_parts(paths, columns=None):
+    return pd.concat([read_csv_part(path, columns) for path in paths], ignore_index=True)
+
+def part_columns_csv(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def typed_frame(df):
+    """Give every column a single type parquet can store.
+
+    Numeric and boolean columns keep their dtype. Other columns hold text, so
+    their non-missing values are stored as the strings they would be in a CSV.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            values = df[column]
+            df[column] = values.where(values.isna(), values.astype(str))
+    return df
+
+def write_parquet_part(df, path):
+    require_pyarrow()
+    typed_frame(df).to_parquet(path, index=False, compression='zstd')
+
+def read_parquet_table(path, columns=None):
+    require_pyarrow()
+    if columns is not None:
+        # Parts written from different shards can have different columns, so only the ones present are requested
+        columns = [column for column in pq.read_schema(path).names if column in columns]
+    return pq.read_table(path, columns=columns)
+
+def read_parquet_part(path, columns=None):
+    return read_parquet_table(path, columns).to_pandas()
+
+def read_parquet_parts(paths, columns=None):
+    """Join the parts as Arrow tables and convert to pandas once.
+
+    A column that is empty in one part is stored as a number there and as text
+    in another; Arrow cannot join those, so pandas joins the parts instead.
+    """
+    tables = [read_parquet_table(path, columns) for path in paths]
+    try:
+        return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pd.concat([table.to_pandas() for table in tables], ignore_index=True)
+
+def part_columns_parquet(path):
+    require_pyarrow()
+    return list(pq.read_schema(path).names)
+
+STORAGE_BACKENDS = {
+    'csv': {'extension': '.csv', 'write': write_csv_part, 'read': read_csv_part, 'read_many': read_csv_parts, 'columns': part_columns_csv},
+    'parquet': {'extension': '.parquet', 'write': write_parquet_part, 'read': read_parquet_part, 'read_many': read_parquet_parts, 'columns': part_columns_parquet},
+}
+
+def event_months(df, carry_month=None):
+    """Return the 'YYYY-MM' partition of every row, from the forward-filled event date.
+
+    Rows before the shard's first event row belong to an event that started in
+    the previous shard, so they take carry_month.
+    """
+    if 'date' not in df.columns:
+        return pd.Series(carry_month or 'unknown', index=df.index)
+    # Only event rows have a date and repeated values are masked in the shards, so dates are carried down
+    dates = df['date'].ffill()
+    parsed = pd.to_datetime(dates, format='%Y-%m-%d', errors='coerce')
+    # Dates rewritten in day-first form by other stages are accepted too
+    parsed = parsed.fillna(pd.to_datetime(dates, format='%d/%m/%Y', errors='coerce'))
+    months = parsed.dt.strftime('%Y-%m')
+    months = months.where(parsed.notna(), 'unknown')
+    return months.where(dates.notna(), carry_month or 'unknown')
+
+def partition_dir(dataset_dir, month):
+    return os.path.join(dataset_dir, f"month={month}")
+
+def list_partitions(dataset_dir):
+    """Sorted months that have a partition in the dataset."""
+    return sorted(os.path.basename(path).split('=', 1)[1] for path in glob.glob(os.path.join(dataset_dir, 'month=*')))
+
+def shard_number(path):
+    return int(os.path.splitext(os.path.basename(path))[0].split('_')[-1])
+
+def list_parts(dataset_dir, months=None, backend='parquet'):
+    """Part files of the selected months, in month order and then shard order."""
+    extension = STORAGE_BACKENDS[backend]['extension']
+    parts = []
+    for month in list_partitions(dataset_dir):
+        if months is not None and month not in months:
+            continue
+        parts.extend(sorted(glob.glob(os.path.join(partition_dir(dataset_dir, month), '*' + extension)), key=shard_number))
+    return parts
+
+def load_sources(dataset_dir):
+    """Load the shard name -> {'checksum', 'carry_month', 'last_month', 'backend'} record of converted shards."""
+    sources_path = os.path.join(dataset_dir, '_sources.json')
+    if not os.path.exists(sources_path):
+        return {}
+    with open(sources_path, 'r') as file:
+        return json.load(file)
+
+def save_sources(sources, dataset_dir):
+    sources_path = os.path.join(dataset_dir, '_sources.json')
+    with open(sources_path + '.tmp', 'w') as file:
+        json.dump(sources, file, indent=2)
+    os.replace(sources_path + '.tmp', sources_path)
+
+def write_shard_partitions(df, shard_name, dataset_dir, backend='parquet', carry_month=None):
+    """Split one shard's rows by event month and write one part per month.
+
+    Parts are named after the shard, so rewriting a shard replaces exactly the
+    parts it wrote before. Returns the month of the shard's last row.
+    """
+    storage = STORAGE_BACKENDS[backend]
+    stem = os.path.splitext(shard_name)[0]
+    for old_part in glob.glob(os.path.join(dataset_dir, 'month=*', stem + storage['extension'])):
+        os.remove(old_part)
+
+    months = event_months(df, carry_month)
+    for month, rows in df.groupby(months, sort=False):
+        os.makedirs(partition_dir(dataset_dir, month), exist_ok=True)
+        storage['write'](rows.reset_index(drop=True), os.path.join(partition_dir(dataset_dir, month), stem + storage['extension']))
+    return months.iloc[-1] if len(months) else carry_month
+
+def convert_shards(csv_files, dataset_dir, manifest, backend='parquet'):
+    """Write the CSV shards into the partitioned dataset, converting only shards that changed.
+
+    A shard is converted again when its checksum in the shard manifest changed,
+    when one of its sidecars changed, or when the month carried into it from
+    the previous shard did. Parts of
+    shards that no longer exist are removed.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    sources = load_sources(dataset_dir)
+    shard_names = {os.path.basename(csv_file) for csv_file in csv_files}
+    for shard_name in [shard_name for shard_name in sources if shard_name not in shard_names]:
+        stem = os.path.splitext(shard_name)[0]
+        for old_part in glob.glob(os.path.join(dataset_dir, 'month=*', stem + '.*')):
+            os.remove(old_part)
+        del sources[shard_name]
+    carry_month = None
+    for csv_file in csv_files:
+        shard_name = os.path.basename(csv_file)
+        checksum = manifest[shard_name]['checksum']
+        sidecars = sidecar_signature(csv_file)
+        source = sources.get(shard_name)
+        if source is not None and source['checksum'] == checksum and source.get('sidecars', {}) == sidecars and source['carry_month'] == carry_month and source['backend'] == backend:
+            carry_month = source['last_month']
+            continue
+        # The dataset holds the enriched view, so the enrichers' sidecars are joined in
+        df = join_sidecars(pd.read_csv(csv_file, low_memory=False), csv_file)
+        last_month = write_shard_partitions(df, shard_name, dataset_dir, backend, carry_month)
+        sources[shard_name] = {'checksum': checksum, 'sidecars': sidecars, 'carry_month': carry_month, 'last_month': last_month, 'backend': backend}
+        carry_month = last_month
+        print(f"Converted {csv_file} to {backend} partitions")
+    save_sources(sources, dataset_dir)
+
+def months_since(months_back, today=None):
+    """The 'YYYY-MM' months within the last months_back months, for partition pruning."""
+    today = pd.Timestamp.today() if today is None else pd.Timestamp(today)
+    return [(today - pd.DateOffset(months=offset)).strftime('%Y-%m') for offset in range(months_back + 1)]
+
+def read_dataset(dataset_dir, columns=None, months=None, backend='parquet'):
+    """Load the dataset, reading only the given columns of the given month partitions."""
+    parts = list_parts(dataset_dir, months, backend)
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return STORAGE_BACKENDS[backend]['read_many'](parts, columns)
+
+def export_csv(dataset_dir, csv_path, columns=None, months=None, backend='parquet'):
+    """Write the dataset out as one CSV, part by part, for tools such as Grafana that read CSV."""
+    storage = STORAGE_BACKENDS[backend]
+    parts = list_parts(dataset_dir, months, backend)
+    # The header is the union of all parts' columns so that parts can be appended one at a time
+    header = {}
+    for part in parts:
+        for column in storage['columns'](part):
+            if columns is None or column in columns:
+                header.setdefault(column, None)
+    header = list(header)
+    pd.DataFrame(columns=header).to_csv(csv_path, index=False)
+    for part in parts:
+        storage['read'](part, columns).reindex(columns=header).to_csv(csv_path, mode='a', header=False, index=False)
+    print(f"Exported {len(parts)} partition files to {csv_path}")
+
+if __name__ == '__main__':
+    from ShardManifest import refresh_manifest
+
+    # Convert the CSV shards in ./official into a month-partitioned parquet dataset
+    dataset_dir = './official_dataset'
+    backend = 'parquet'
+    csv_files = sorted(glob.glob('./official/official_part_*.csv'), key=shard_number)
+    manifest = refresh_manifest(csv_files)
+    convert_shards(csv_files, dataset_dir, manifest, backend)
+    print(f"Partitions: {', '.join(list_partitions(dataset_dir))}")
@@ -0,0 +1,64 @@
+import pandas as pd
+
+def clean_text(text):
+    """Remove problematic characters and sanitize text for Excel."""
+    if isinstance(text, str):
+        return ''.join(c for c in text if c.isprintable()).replace('\r', '').replace('\n', ' ').replace('\t', ' ')
+    return text
+
+class PrintableTable(dict):
+    """str.translate table deleting every character for which str.isprintable() is False.
+
+    clean_text drops these characters one by one; '\r', '\n' and '\t' are among
+    them, so its replace calls never find anything and deleting them is enough
+    to reproduce it exactly. Each code point is checked once, the first time it
+    is seen, and the answer is cached in the table.
+    """
+
+    def __missing__(self, code_point):
+        value = code_point if chr(code_point).isprintable() else None
+        self[code_point] = value
+        return value
+
+NON_PRINTABLE_TABLE = PrintableTable()
+
+def clean_text_column(column):
+    """Vectorized clean_text for one column; non-string cells and non-text columns are left alone."""
+    if not (column.dtype == object or pd.api.types.is_string_dtype(column.dtype)):
+        return column
+    values = column.to_numpy(dtype=object, copy=True)
+    is_text = column.map(type).eq(str).to_numpy()
+    if not is_text.any():
+        return column
+    texts = pd.Series(values[is_text], dtype=object)
+    # Only strings that actually contain a problematic character are rewritten
+    dirty = ~texts.map(str.isprintable).to_numpy(dtype=bool)
+    if not dirty.any():
+        return column
+    positions = is_text.nonzero()[0][dirty]
+    values[positions] = texts[dirty].str.translate(NON_PRINTABLE_TABLE).to_numpy()
+    return pd.Series(values, index=column.index, name=column.name, dtype=column.dtype)
+
+def clean_text_columns(df, columns=None):
+    """Apply clean_text_column to every text column of a DataFrame in place."""
+    for column in (columns if columns is not None else df.columns):
+        df[column] = clean_text_column(df[column])
+    return df
+
+def reclean_csv_files(csv_files):
+    """Re-clean existing CSV shards, rewriting only the files where something changed."""
+    for csv_file in csv_files:
+        df = pd.read_csv(csv_file, low_memory=False)
+        before = df.copy()
+        clean_text_columns(df)
+        if df.equals(before):
+            print(f"No problematic characters in {csv_file}")
+            continue
+        df.to_csv(csv_file, index=False)
+        print(f"Re-cleaned {csv_file}")
+
+if __name__ == '__main__':
+    import glob
+    import os
+    csv_files = sorted(glob.glob('./official/official_part_*.csv'), key=lambda x: int(os.path.splitext(x.split('_')[-1])[0]))
+    reclean_csv_files(csv_files)
@@ -0,0 +1,36 @@
+import pandas as pd
+
+def upsert(primary, secondary, key):
+    """Insert secondary rows with new keys into primary and fill primary's gaps from matching rows.
+
+    Rows are aligned on the key through an index instead of a merge, and only
+    rows whose key appears in secondary are looked at. Values already present in
+    primary take precedence, and all shared columns of the matching rows are
+    filled in one vectorized step. Primary keeps its row order and columns;
+    new rows are appended in secondary's order. Secondary rows without a key are
+    ignored and only the first row of a repeated key is used. Returns the
+    combined DataFrame and counts of inserted and updated rows.
+    """
+    secondary = secondary.dropna(subset=[key]).drop_duplicates(subset=key, keep='first')
+    shared_columns = [column for column in primary.columns if column in secondary.columns and column != key]
+
+    # One secondary row per matching primary row, looked up by key
+    matched = primary[key].isin(secondary[key]).to_numpy()
+    current = primary.loc[matched, shared_columns]
+    aligned = secondary.set_index(key)[shared_columns].reindex(primary.loc[matched, key])
+    aligned.index = current.index
+    fill = current.isna() & aligned.notna()
+    updated_rows = fill.any(axis=1)
+
+    inserted = secondary[~secondary[key].isin(primary[key])].reindex(columns=primary.columns)
+    result = pd.concat([primary, inserted], ignore_index=True) if len(inserted) else primary.copy()
+
+    if updated_rows.any():
+        # Primary's rows keep their positions in the result, the new rows only come after them
+        positions = matched.nonzero()[0][updated_rows.to_numpy()]
+        filled = current[updated_rows].mask(fill[updated_rows], aligned[updated_rows])
+        for column in shared_columns:
+            if result[column].dtype != filled[column].dtype and not (pd.api.types.is_numeric_dtype(result[column]) and pd.api.types.is_numeric_dtype(filled[column])):
+                result[column] = result[column].astype(object)
+        result.iloc[positions, [result.columns.get_loc(column) for column in shared_columns]] = filled.to_numpy()
+    return result, {'inserted': len(inserted), 'updated': int(updated_rows.sum())}
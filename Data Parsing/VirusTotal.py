@@ -2,6 +2,10 @@ import pandas as pd
 import os
 import requests
 import time
+from ShardManifest import is_enriched, mark_enriched, refresh_manifest, shard_entry
+from Sidecars import join_sidecars, row_keys, write_sidecar
+from VirusTotalCache import lookup_hashes, new_stats, open_cache, print_stats, store_hash
+from VirusTotalScheduler import INFO_COLUMNS, clear_failures, drain_bucket, next_hashes, open_queue, pending_hash_keys, record_failure, sync_queue, take_token
 
 # Function to call the VirusTotal API and extract tactics, techniques, and signatures for a given hash value
 def query_virustotal(hash_value, api_key):
@@ -24,8 +28,9 @@ def query_virustotal(hash_value, api_key):
         print(f"Error: No data found for {hash_value}. Status Code: 404")
         return {}
     elif response.status_code != 200:
+        # Other failures may be transient, so they are not cached as missing data
         print(f"Error: Failed to retrieve data for {hash_value}. Status Code: {response.status_code}")
-        return {}
+        return None
 
     if 'data' in data and 'CAPA' in data['data']:
         capa_data = data['data']['CAPA']
@@ -34,85 +39,135 @@ def query_virustotal(hash_value, api_key):
         print(f"Warning: CAPA data not found for {hash_value}.")
         return {}
 
-# Load the CSV file and process the data
-def process_csv(input_file_path, api_key):
-    df = pd.read_csv(input_file_path, low_memory=False)
-
-    for col in ['Tactic_Info', 'Technique_Info', 'Signature_Info']:
+# Turn the CAPA tree of a report into the tactic, technique and signature strings stored in the CSV
+def format_capa(capa_data):
+    tactic_info = []
+    technique_info = []
+    signature_info = []
+
+    for tactic in capa_data.get('tactics', []):
+        tactic_info.append(f"{tactic['id']}: {tactic['name']}")
+        techniques = tactic.get('techniques', [])
+        for technique in techniques:
+            technique_info.append(f"{technique['id']}: {technique['name']}")
+            signatures = technique.get('signatures', [])
+            for signature in signatures:
+                signature_info.append(f"{signature['severity']}: {signature['description']}")
+
+    return '; '.join(tactic_info), '; '.join(technique_info), '; '.join(signature_info)
+
+# Fill the shard's pending hash rows from the cache; returns how many of its hashes are still unresolved
+def fill_csv(input_file_path, connection, stats):
+    # Earlier results live in the shard's VirusTotal sidecar, the shard itself is never rewritten
+    df = join_sidecars(pd.read_csv(input_file_path, low_memory=False), input_file_path, ['virustotal'])
+
+    for col in INFO_COLUMNS:
         if col not in df.columns:
             df[col] = None
 
-    hash_types = ['sha256', 'sha1', 'md5']
-
-    last_value_row = df['Tactic_Info'].last_valid_index()
-    start_index = 0 if last_value_row is None else last_value_row + 1
-
-    for index, row in df.iloc[start_index:].iterrows():
-        if pd.isna(row['Tactic_Info']) and pd.isna(row['Technique_Info']) and pd.isna(row['Signature_Info']):
-            attribute_value = row['attribute_value']
-            if pd.isna(attribute_value):
+    hash_keys = pending_hash_keys(df)
+    if hash_keys.empty:
+        print(f"No hashes left to look up in {input_file_path}")
+        return 0
+
+    # Each distinct hash is looked up once and fills all of its rows
+    distinct_hashes = hash_keys.unique()
+    results = lookup_hashes(connection, distinct_hashes, stats)
+    found = {hash_value: info for hash_value, info in results.items() if info is not None}
+    rows = hash_keys[hash_keys.isin(found.keys())]
+    if not rows.empty:
+        values = pd.DataFrame([found[hash_value] for hash_value in rows], index=rows.index, columns=INFO_COLUMNS)
+        write_sidecar(input_file_path, 'virustotal', row_keys(df, input_file_path).loc[rows.index], values)
+        print(f"Updated {len(rows)} rows, saved to the VirusTotal sidecar of {input_file_path}")
+
+    return len(distinct_hashes) - len(results)
+
+# Query the queued hashes in priority order, spending calls only as fast as the quotas allow
+def run_queue(connection, api_key, requests_per_minute, requests_per_day, max_wait=60):
+    buckets = {'minute': (requests_per_minute, 60), 'day': (requests_per_day, 24 * 3600)}
+    counts = {'queried': 0, 'found': 0, 'not_found': 0, 'errors': 0}
+    rejected = 0
+
+    while True:
+        batch = next_hashes(connection)
+        if not batch:
+            print("No hashes left in the queue.")
+            return counts
+        for hash_value, priority, rows in batch:
+            wait = take_token(connection, buckets)
+            while wait > 0:
+                if wait > max_wait:
+                    print(f"Quota used up, the next request is possible in {wait / 60:.0f} minutes. Stopping further requests.")
+                    return counts
+                time.sleep(wait)
+                wait = take_token(connection, buckets)
+
+            print(f"Processing hash value: {hash_value} (priority {priority:g}, {rows} rows)")
+            capa_data = query_virustotal(hash_value, api_key)
+
+            if capa_data == "quota_exceeded":
+                # The API ran out before the buckets did, e.g. the key is shared; wait for the
+                # next minute, and after repeated refusals treat the daily quota as spent
+                rejected += 1
+                drain_bucket(connection, 'minute')
+                if rejected >= 3:
+                    drain_bucket(connection, 'day')
+                    print("Quota exceeded, stopping further requests.")
+                    return counts
+                break
+            rejected = 0
+            counts['queried'] += 1
+
+            if capa_data is None:
+                record_failure(connection, hash_value)
+                counts['errors'] += 1
                 continue
-
-            attribute_type = row['attribute_type'].lower()
-            if any(ht in attribute_type for ht in hash_types):
-                hash_value = str(attribute_value).strip()
-                print(f"Processing row {index} with hash value: {hash_value}")
-
-                capa_data = query_virustotal(hash_value, api_key)
-
-                if capa_data == "quota_exceeded":
-                    return "quota_exceeded"
-
-                if not capa_data:
-                    print(f"No relevant data found for hash value: {hash_value}")
-                    continue
-
-                tactics = capa_data.get('tactics', [])
-                tactic_info = []
-                technique_info = []
-                signature_info = []
-
-                for tactic in tactics:
-                    tactic_info.append(f"{tactic['id']}: {tactic['name']}")
-                    techniques = tactic.get('techniques', [])
-                    for technique in techniques:
-                        technique_info.append(f"{technique['id']}: {technique['name']}")
-                        signatures = technique.get('signatures', [])
-                        for signature in signatures:
-                            signature_info.append(f"{signature['severity']}: {signature['description']}")
-
-                tactic_str = '; '.join(tactic_info)
-                technique_str = '; '.join(technique_info)
-                signature_str = '; '.join(signature_info)
-
-                df.at[index, 'Tactic_Info'] = tactic_str
-                df.at[index, 'Technique_Info'] = technique_str
-                df.at[index, 'Signature_Info'] = signature_str
-
-                time.sleep(15)  # Wait to respect the rate limit
-
-    df.to_csv(input_file_path, index=False)
-    print(f"Updated CSV saved to {input_file_path}")
-
-    return None
+            # 404s and reports without CAPA data are cached as well, so they are not asked for again
+            info = format_capa(capa_data) if capa_data else None
+            store_hash(connection, hash_value, info)
+            clear_failures(connection, hash_value)
+            counts['found' if info else 'not_found'] += 1
 
 # Function to process multiple CSV files
-def process_multiple_csv_files(file_paths, api_key):
+def process_multiple_csv_files(file_paths, api_key, directory='.', cache_path='virustotal_cache.sqlite', requests_per_minute=4, requests_per_day=500):
+    manifest = refresh_manifest(file_paths, directory)
+    shards = []
     for file_path in sorted(file_paths):
+        # Shards without hash attributes, or enriched since they last changed, are skipped without being parsed
+        if not {'attribute_type', 'attribute_value'} <= set(shard_entry(manifest, file_path)['columns']):
+            print(f"No attribute columns in {file_path}, skipping")
+            continue
+        if is_enriched(manifest, file_path, 'virustotal'):
+            print(f"VirusTotal data already up to date in {file_path}")
+            continue
+        shards.append(file_path)
+
+    connection = open_cache(cache_path)
+    open_queue(connection)
+    sync_queue(connection, manifest, shards)
+    counts = run_queue(connection, api_key, requests_per_minute, requests_per_day)
+    print(f"Queried {counts['queried']} hashes: {counts['found']} with MITRE data, {counts['not_found']} without, {counts['errors']} errors")
+
+    # Results are written back to every shard in one pass, whether or not the queue was finished
+    stats = new_stats()
+    for file_path in shards:
         print(f"Processing file: {file_path}")
-        quota_exceeded = process_csv(file_path, api_key)
-        if quota_exceeded == "quota_exceeded":
-            print(f"Quota exceeded while processing {file_path}. Stopping further requests.")
-            break
-        print(f"Finished processing file: {file_path}\n")
-
-# Variables
-api_key = ''
-input_directory = '.'
-file_pattern = 'official_part_*.csv'
-
-# Find all files matching the pattern in the directory
-file_paths = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.startswith('official_part_') and f.endswith('.csv')]
-
-# Run the function
-process_multiple_csv_files(file_paths, api_key)
+        if fill_csv(file_path, connection, stats) == 0:
+            mark_enriched(manifest, file_path, 'virustotal', directory)
+            print(f"Finished processing file: {file_path}\n")
+    connection.close()
+    print_stats(stats)
+
+if __name__ == '__main__':
+    # Variables
+    api_key = ''
+    requests_per_minute = 4
+    requests_per_day = 500
+    input_directory = '.'
+    file_pattern = 'official_part_*.csv'
+
+    # Find all files matching the pattern in the directory
+    file_paths = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.startswith('official_part_') and f.endswith('.csv')]
+
+    # Run the function
+    process_multiple_csv_files(file_paths, api_key, input_directory, requests_per_minute=requests_per_minute, requests_per_day=requests_per_day)
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+# Found reports rarely change, so they are kept for a month; hashes VirusTotal
+# has no report for are retried after a day in case it analysed them since
+FOUND_TTL = 30 * 24 * 3600
+NOT_FOUND_TTL = 24 * 3600
+
+def normalise_hash(value):
+    """Hashes are case-insensitive hex, so the same file is always cached under one key."""
+    return str(value).strip().lower()
+
+def open_cache(cache_path='virustotal_cache.sqlite'):
+    """Open the hash cache, creating its table on first use."""
+    connection = sqlite3.connect(cache_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS hashes ("
+        "hash TEXT PRIMARY KEY, found INTEGER NOT NULL, tactic_info TEXT, technique_info TEXT, "
+        "signature_info TEXT, fetched_at INTEGER NOT NULL)"
+    )
+    connection.commit()
+    return connection
+
+def new_stats():
+    return {'hits': 0, 'negative_hits': 0, 'misses': 0, 'expired': 0}
+
+def lookup_hashes(connection, hash_values, stats, now=None):
+    """Return {hash: (tactic_info, technique_info, signature_info) or None} for every fresh cached hash.
+
+    None marks a hash VirusTotal has no MITRE data for. Hashes missing from the
+    result have never been looked up or their entry expired and must be queried.
+    """
+    now = int(time.time()) if now is None else now
+    hash_values = list(hash_values)
+    cached = {}
+    # SQLite limits the number of bound parameters, so the lookup is done in batches
+    for start in range(0, len(hash_values), 500):
+        batch = hash_values[start:start + 500]
+        rows = connection.execute(
+            f"SELECT hash, found, tactic_info, technique_info, signature_info, fetched_at FROM hashes WHERE hash IN ({','.join('?' * len(batch))})",
+            batch
+        )
+        for hash_value, found, tactic_info, technique_info, signature_info, fetched_at in rows:
+            if now - fetched_at > (FOUND_TTL if found else NOT_FOUND_TTL):
+                stats['expired'] += 1
+                continue
+            if found:
+                cached[hash_value] = (tactic_info, technique_info, signature_info)
+                stats['hits'] += 1
+            else:
+                cached[hash_value] = None
+                stats['negative_hits'] += 1
+    stats['misses'] += len(hash_values) - len(cached)
+    return cached
+
+def store_hash(connection, hash_value, info, now=None):
+    """Cache a lookup result; info is the three MITRE strings, or None if VirusTotal has no data."""
+    now = int(time.time()) if now is None else now
+    tactic_info, technique_info, signature_info = info if info is not None else (None, None, None)
+    connection.execute(
+        "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+        (hash_value, int(info is not None), tactic_info, technique_info, signature_info, now)
+    )
+    # Committed straight away so a paid lookup is never lost to a crash
+    connection.commit()
+
+def print_stats(stats, label='VirusTotal cache'):
+    looked_up = stats['hits'] + stats['negative_hits'] + stats['misses']
+    hit_rate = (stats['hits'] + stats['negative_hits']) / looked_up * 100 if looked_up else 0.0
+    print(f"{label}: {looked_up} distinct hashes, {stats['hits']} hits, {stats['negative_hits']} negative hits, "
+          f"{stats['misses']} misses ({stats['expired']} expired), hit rate {hit_rate:.1f}%")
@@ -0,0 +1,156 @@
+import time
+import pandas as pd
+from ShardManifest import shard_entry
+from Sidecars import is_key_column, join_sidecars
+from VirusTotalCache import FOUND_TTL, NOT_FOUND_TTL, normalise_hash
+
+# A hash that failed too often is left alone for a day before it is tried again
+FAILURE_TTL = 24 * 3600
+
+INFO_COLUMNS = ['Tactic_Info', 'Technique_Info', 'Signature_Info']
+HASH_TYPES = ['sha256', 'sha1', 'md5']
+
+# MISP threat levels: 1 High, 2 Medium, 3 Low, 4 Undefined
+THREAT_LEVEL_WEIGHTS = {1: 4, 2: 3, 3: 2, 4: 1}
+
+def open_queue(connection):
+    """Create the scheduler tables next to the hash cache.
+
+    shard_hashes holds what each shard still needs: every pending hash with its
+    row count and a score summed over the events it appears in. shard_scans
+    records the checksum each shard was scanned at, so an unchanged shard is
+    never read again and the queue survives restarts. failures counts
+    transient errors per hash, with the time of the last one.
+    """
+    connection.executescript(
+        "CREATE TABLE IF NOT EXISTS shard_scans (shard TEXT PRIMARY KEY, checksum TEXT NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS shard_hashes (shard TEXT NOT NULL, hash TEXT NOT NULL, rows INTEGER NOT NULL, "
+        "events INTEGER NOT NULL, score REAL NOT NULL, PRIMARY KEY (shard, hash));"
+        "CREATE TABLE IF NOT EXISTS failures (hash TEXT PRIMARY KEY, attempts INTEGER NOT NULL, failed_at INTEGER NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);"
+    )
+    # Queues created before failures expired have no failure times; their failures count as old
+    if 'failed_at' not in [row[1] for row in connection.execute("PRAGMA table_info(failures)")]:
+        connection.execute("ALTER TABLE failures ADD COLUMN failed_at INTEGER NOT NULL DEFAULT 0")
+    connection.commit()
+
+def pending_hash_keys(df):
+    """Normalised hash of every row that is a file hash attribute still missing its MITRE data."""
+    info = df.reindex(columns=INFO_COLUMNS)
+    pending = (
+        info.isna().all(axis=1)
+        & df['attribute_value'].notna()
+        & df['attribute_type'].astype(str).str.lower().str.contains('|'.join(HASH_TYPES), na=False)
+    )
+    return df.loc[pending, 'attribute_value'].map(normalise_hash)
+
+def score_shard(file_path):
+    """Return one row per pending hash of a shard with its row count, event count and score.
+
+    A hash is worth more the more events it appears in and the higher their
+    threat level, so each distinct event adds the weight of its threat level.
+    """
+    columns = pd.read_csv(file_path, nrows=0).columns
+    usecols = [column for column in columns if column in ['threat_level_id', 'attribute_type', 'attribute_value'] + INFO_COLUMNS or is_key_column(column)]
+    df = join_sidecars(pd.read_csv(file_path, usecols=usecols, low_memory=False), file_path, ['virustotal'])
+    if not {'attribute_type', 'attribute_value'} <= set(df.columns):
+        return pd.DataFrame(columns=['hash', 'rows', 'events', 'score'])
+
+    # Event fields are only written on an event's first row
+    events = df.reindex(columns=['event_id', 'threat_level_id']).apply(pd.to_numeric, errors='coerce').ffill()
+    hash_keys = pending_hash_keys(df)
+    rows = pd.DataFrame({
+        'hash': hash_keys,
+        'event_id': events.loc[hash_keys.index, 'event_id'].fillna(-1),
+        'weight': events.loc[hash_keys.index, 'threat_level_id'].map(THREAT_LEVEL_WEIGHTS).fillna(1)
+    })
+    per_event = rows.drop_duplicates(subset=['hash', 'event_id'])
+    return pd.DataFrame({
+        'rows': rows.groupby('hash').size(),
+        'events': per_event.groupby('hash').size(),
+        'score': per_event.groupby('hash')['weight'].sum()
+    }).reset_index()
+
+def sync_queue(connection, manifest, file_paths):
+    """Rescan the shards that changed since their last scan and drop shards that are gone."""
+    scanned = dict(connection.execute("SELECT shard, checksum FROM shard_scans"))
+    for file_path in file_paths:
+        checksum = shard_entry(manifest, file_path)['checksum']
+        if scanned.get(file_path) == checksum:
+            continue
+        scores = score_shard(file_path)
+        connection.execute("DELETE FROM shard_hashes WHERE shard = ?", (file_path,))
+        connection.executemany(
+            "INSERT INTO shard_hashes VALUES (?, ?, ?, ?, ?)",
+            [(file_path, hash_value, int(rows), int(events), float(score)) for hash_value, rows, events, score in scores.itertuples(index=False)]
+        )
+        connection.execute("INSERT OR REPLACE INTO shard_scans VALUES (?, ?)", (file_path, checksum))
+        connection.commit()
+        print(f"Queued {len(scores)} pending hashes from {file_path}")
+    for file_path in set(scanned) - set(file_paths):
+        connection.execute("DELETE FROM shard_hashes WHERE shard = ?", (file_path,))
+        connection.execute("DELETE FROM shard_scans WHERE shard = ?", (file_path,))
+    connection.commit()
+
+def next_hashes(connection, limit=100, max_attempts=3, now=None):
+    """Return the highest ranked hashes that are neither freshly cached nor failed too often.
+
+    Hashes are ranked by their score over all shards, then by row count. A
+    hash that failed max_attempts times is retried once FAILURE_TTL has passed
+    since its last failure.
+    """
+    now = int(time.time()) if now is None else now
+    return connection.execute(
+        "SELECT q.hash, SUM(q.score) AS priority, SUM(q.rows) AS rows FROM shard_hashes q "
+        "LEFT JOIN hashes c ON c.hash = q.hash LEFT JOIN failures f ON f.hash = q.hash "
+        "WHERE (c.hash IS NULL OR (c.found = 1 AND c.fetched_at < ?) OR (c.found = 0 AND c.fetched_at < ?)) "
+        "AND (f.attempts IS NULL OR f.attempts < ? OR f.failed_at < ?) "
+        "GROUP BY q.hash ORDER BY priority DESC, rows DESC, q.hash LIMIT ?",
+        (now - FOUND_TTL, now - NOT_FOUND_TTL, max_attempts, now - FAILURE_TTL, limit)
+    ).fetchall()
+
+def record_failure(connection, hash_value, now=None):
+    now = int(time.time()) if now is None else now
+    connection.execute(
+        "INSERT INTO failures VALUES (?, 1, ?) ON CONFLICT(hash) DO UPDATE SET attempts = attempts + 1, failed_at = excluded.failed_at",
+        (hash_value, now)
+    )
+    connection.commit()
+
+def clear_failures(connection, hash_value):
+    """Forget a hash's failures once it was looked up, so a later error starts counting afresh."""
+    connection.execute("DELETE FROM failures WHERE hash = ?", (hash_value,))
+    connection.commit()
+
+def refill_bucket(connection, name, capacity, period, now):
+    """Return the tokens a bucket holds at now; it refills at capacity tokens per period seconds."""
+    row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return float(capacity)
+    tokens, updated_at = row
+    return min(float(capacity), tokens + max(0.0, now - updated_at) * capacity / period)
+
+def take_token(connection, buckets, now=None):
+    """Take one token from every bucket if all of them have one.
+
+    buckets maps a name to (capacity, period). Returns 0 when the tokens were
+    taken, otherwise the seconds until every bucket has a token again. The
+    bucket levels are stored so the daily quota is respected across restarts.
+    """
+    now = time.time() if now is None else now
+    levels = {name: refill_bucket(connection, name, capacity, period, now) for name, (capacity, period) in buckets.items()}
+    wait = max((1 - tokens) * buckets[name][1] / buckets[name][0] for name, tokens in levels.items())
+    if wait > 0:
+        return wait
+    connection.executemany(
+        "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+        [(name, tokens - 1, now) for name, tokens in levels.items()]
+    )
+    connection.commit()
+    return 0
+
+def drain_bucket(connection, name, now=None):
+    """Empty a bucket, for when the API says its quota is used up before the bucket does."""
+    now = time.time() if now is None else now
+    connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, 0, ?)", (name, now))
+    connection.commit()
@@ -123,16 +123,41 @@ def ioccounter(dataset, column_name):
 
     return sorted_total_counts
 
-def combine_csv(directory,filename):
+def combine_csv(directory,filename,columns=None):
+    # Enrichment results are kept in sidecars next to the shards and joined in on read
+    sys.path.append(os.path.join('..', 'Data Parsing'))
+    from Sidecars import read_enriched
     arr = pd.DataFrame()
-    files = os.listdir(directory)
-    for i in range(1,len(files),1):
+    # Count only the shards, the directory also holds the shard manifest and event index
+    files = [f for f in os.listdir(directory) if f.startswith(filename) and f.endswith(".csv")]
+    for i in range(1,len(files)+1,1):
         filenamefinal = directory+"/"+filename+str(i)+".csv"
-        df = pd.read_csv(filenamefinal,low_memory=False)
+        # Read only the columns that are needed, if given
+        df = read_enriched(filenamefinal,columns=columns)
         arr = pd.concat([arr,df])
         print("[+] Successfully combined filename",filenamefinal)
     return arr
 
+def combine_dataset(directory,columns=None,month=None):
+    # Read the month-partitioned dataset written by Data Parsing/Storage.py
+    # Only the given columns, and only the partitions of the last `month` months, are loaded
+    sys.path.append(os.path.join('..', 'Data Parsing'))
+    from Storage import months_since, read_dataset
+    months = None if month is None else months_since(month)
+    arr = read_dataset(directory, columns, months)
+    print("[+] Successfully combined dataset",directory)
+    return arr
+
+def readnormalized(directory):
+    # Read the events and attributes tables written in the normalized output mode
+    # Every row already carries its event's fields, so events are grouped by event_id instead of rebuilt from blank rows
+    sys.path.append(os.path.join('..', 'Data Parsing'))
+    from NormalizedTables import read_events_with_attributes
+    arr = read_events_with_attributes(directory+"/events.csv", directory+"/attributes.csv")
+    split = [group for _, group in arr.groupby('event_id', sort=False)]
+    print("[+] Successfully read normalized tables from",directory)
+    return split
+
 def baseline1(row):
     return {
         'attribute_id': row['attribute_id'], 
@@ -196,9 +221,12 @@ def custom_date_parser(date_string):
 # In[3]:
 
 
-arr = combine_csv("official","official_part_")
+# The dataset is built from the shards, with the enrichers' sidecars joined in, by Data Parsing/Storage.py
+arr = combine_dataset("official_dataset")
 df = readfile(arr)
-datefilter = findbydate(df,6) # filter data by months 
+# Only the event ids and dates of the last 6 months' partitions are needed to filter by date
+recent = readfile(combine_dataset("official_dataset",columns=["event_id","date"],month=6))
+datefilter = findbydate(recent,6) # filter data by months 
 #make cleanser function here 
 
 # count = ioccounter(testing,"ip-dst")